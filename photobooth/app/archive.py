@@ -0,0 +1,45 @@
+import atexit
+import logging
+import os
+from pathlib import Path
+import queue
+import threading
+from typing import Optional, Tuple
+
+
+# Writes files on a background thread so slow storage (SD card) never blocks processing
+class ArchiveWriter:
+    def __init__(self) -> None:
+        self.queue: "queue.Queue[Optional[Tuple[Path, bytes]]]" = queue.Queue()
+        self.thread: Optional[threading.Thread] = None
+        self.lock = threading.Lock()
+
+    def _start(self):
+        with self.lock:
+            if self.thread is not None:
+                return
+            self.thread = threading.Thread(target=self._run, name="archive-writer", daemon=True)
+            self.thread.start()
+            atexit.register(self.flush)
+
+    def _run(self):
+        while True:
+            path, data = self.queue.get()
+            try:
+                os.makedirs(path.parent, exist_ok=True)
+                # Write next to the target and rename, never leaving a half written file
+                tmp_path = path.with_name(path.name + ".part")
+                with open(tmp_path, "wb") as fh:
+                    fh.write(data)
+                os.replace(tmp_path, path)
+            except OSError as e:
+                logging.error("Could not archive %s: %s", path, e)
+            finally:
+                self.queue.task_done()
+
+    def write(self, path: Path, data: bytes):
+        self._start()
+        self.queue.put((Path(path), data))
+
+    def flush(self):
+        self.queue.join()
@@ -1,52 +1,195 @@
+import asyncio
 import locale
 import logging
 import os
 from pathlib import Path
+import threading
+import time
+from typing import Callable, Optional
 
 import gphoto2 as gp
 
+from app.archive import ArchiveWriter
+from app.entities import Capture
+from app.sessions import content_hash
+
+
+def _file_data(camera, folder: str, name: str) -> bytes:
+    camera_file = camera.file_get(folder, name, gp.GP_FILE_TYPE_NORMAL)
+    return bytes(memoryview(camera_file.get_data_and_size()))
+
+
+def _preview_data(camera) -> bytes:
+    camera_file = camera.capture_preview()
+    return bytes(memoryview(camera_file.get_data_and_size()))
+
 
 class Camera():
     camera = None
     folder: str
 
-    def __init__(self, folder='/tmp') -> None:
+    def __init__(
+        self,
+        folder='/tmp',
+        keep_alive: float = 0,
+        reconnect_attempts: int = 3,
+        reconnect_delay: float = 0.5,
+    ) -> None:
         locale.setlocale(locale.LC_ALL, '')
         logging.basicConfig(
             format='%(levelname)s: %(name)s: %(message)s',
             level=logging.WARNING,
         )
         self.folder = folder
+        self.keep_alive = keep_alive
+        self.reconnect_attempts = reconnect_attempts
+        self.reconnect_delay = reconnect_delay
 
-    async def init(self):
-        if self.camera is not None:
+        # A single session is shared by captures and keep-alive, one call at a time
+        self.lock = threading.RLock()
+        self._logging_callback = None
+        self._keep_alive_stop: Optional[threading.Event] = None
+        self.archive = ArchiveWriter()
+
+    def _connect(self):
+        with self.lock:
+            if self.camera is not None:
+                return
+            if self._logging_callback is None:
+                self._logging_callback = gp.check_result(gp.use_python_logging())
+            camera = gp.Camera()
+            camera.init()
+            self.camera = camera
+
+            # Prepare location
+            os.makedirs(self.folder, exist_ok=True)
+
+    def _disconnect(self):
+        with self.lock:
+            if self.camera is None:
+                return
+            try:
+                self.camera.exit()
+            except gp.GPhoto2Error as e:
+                logging.debug('Could not exit camera: %s', e)
+            self.camera = None
+
+    def _call(self, function: Callable, *args):
+        # Reconnect with an exponential backoff when the USB link dropped
+        delay = self.reconnect_delay
+        for attempt in range(self.reconnect_attempts + 1):
+            try:
+                with self.lock:
+                    self._connect()
+                    return function(self.camera, *args)
+            except gp.GPhoto2Error as e:
+                if attempt == self.reconnect_attempts:
+                    raise
+                logging.warning('Camera error: %s, reconnecting in %.1fs', e, delay)
+                self._disconnect()
+                time.sleep(delay)
+                delay *= 2
+
+    def _call_once(self, function: Callable, *args):
+        # For calls that must not run twice, an error after the shutter fired would take
+        # another picture. The session is reset for the next call and the error raised.
+        with self.lock:
+            self._connect()
+            try:
+                return function(self.camera, *args)
+            except gp.GPhoto2Error:
+                self._disconnect()
+                raise
+
+    def is_healthy(self) -> bool:
+        with self.lock:
+            if self.camera is None:
+                return False
+            try:
+                self.camera.get_summary()
+            except gp.GPhoto2Error as e:
+                logging.warning('Camera health check failed: %s', e)
+                return False
+            return True
+
+    def _keep_alive_loop(self, stop: threading.Event):
+        # Talk to the camera regularly so it does not go to sleep
+        while not stop.wait(self.keep_alive):
+            if self.is_healthy():
+                continue
+            self._disconnect()
+            try:
+                self._call(lambda camera: None)
+            except gp.GPhoto2Error as e:
+                logging.error('Camera is unreachable: %s', e)
+
+    def start_keep_alive(self):
+        if not self.keep_alive or self._keep_alive_stop is not None:
             return
-        callback_obj = gp.check_result(gp.use_python_logging())
-        self.camera = gp.Camera()
-        self.camera.init()
+        self._keep_alive_stop = threading.Event()
+        threading.Thread(
+            target=self._keep_alive_loop,
+            args=(self._keep_alive_stop,),
+            name='camera-keep-alive',
+            daemon=True,
+        ).start()
 
-        # Prepare location
-        os.makedirs(self.folder, exist_ok=True)
+    def stop_keep_alive(self):
+        if self._keep_alive_stop is not None:
+            self._keep_alive_stop.set()
+            self._keep_alive_stop = None
+
+    def capture_preview(self) -> bytes:
+        # A single attempt, a lost preview frame is not worth a reconnection delay
+        with self.lock:
+            self._connect()
+            return _preview_data(self.camera)
+
+    # gphoto2 calls block, run them in a thread so the event loop keeps going
+    async def init(self):
+        await asyncio.to_thread(self._call, lambda camera: None)
 
     async def exit(self):
-        if self.camera is None:
-            return
-        self.camera.exit()
+        self.stop_keep_alive()
+        await asyncio.to_thread(self._disconnect)
 
     async def capture_image(self):
         logging.debug('Capturing image')
-        return self.camera.capture(gp.GP_CAPTURE_IMAGE)
+        # Reconnecting is safe to retry, the capture itself is not
+        await asyncio.to_thread(self._call, lambda camera: None)
+        return await asyncio.to_thread(
+            self._call_once,
+            lambda camera: camera.capture(gp.GP_CAPTURE_IMAGE),
+        )
 
     async def save(self, capture) -> Path:
         logging.debug('Camera file path: {0}/{1}'.format(capture.folder, capture.name))
         target_path = os.path.join(self.folder, capture.name)
 
-        logging.debug('Copying image to', target_path)
-        camera_file = self.camera.file_get(
-            capture.folder,
-            capture.name,
-            gp.GP_FILE_TYPE_NORMAL,
+        logging.debug('Copying image to %s', target_path)
+        camera_file = await asyncio.to_thread(
+            self._call,
+            lambda camera: camera.file_get(
+                capture.folder,
+                capture.name,
+                gp.GP_FILE_TYPE_NORMAL,
+            ),
         )
 
-        camera_file.save(target_path)
+        await asyncio.to_thread(camera_file.save, target_path)
         return Path(target_path)
+
+    async def download(self, capture) -> Capture:
+        # Straight from the camera to memory, the original is archived in the background
+        logging.debug('Downloading {0}/{1}'.format(capture.folder, capture.name))
+        data = await asyncio.to_thread(self._call, _file_data, capture.folder, capture.name)
+
+        # Named after the content, the camera reuses its file names once its counter wraps
+        digest = await asyncio.to_thread(content_hash, data)
+        downloaded = Capture(
+            name=capture.name,
+            data=data,
+            path=Path(self.folder) / (digest + Path(capture.name).suffix.lower()),
+        )
+        self.archive.write(downloaded.path, downloaded.data)
+        return downloaded
@@ -2,13 +2,20 @@ import asyncio
 from collections.abc import Callable
 import logging
 from pathlib import Path
+import threading
+import time
 from typing import List, Optional
 
+from app import tracing
 from app.camera import Camera
+from app.entities import Capture
 
 
-async def async_capture_image() -> Path:
-    camera = Camera()
+async def async_capture_image(camera: Optional[Camera] = None) -> Path:
+    # A camera passed by the caller keeps its session open
+    owned = camera is None
+    if owned:
+        camera = Camera()
     await camera.init()
     try:
         capture = await camera.capture_image()
@@ -16,7 +23,8 @@ async def async_capture_image() -> Path:
     except Exception:
         raise
     finally:
-        await camera.exit()
+        if owned:
+            await camera.exit()
 
     return local_path
 
@@ -25,49 +33,77 @@ def capture_image() -> Path:
     return asyncio.run(async_capture_image())
 
 
+class CaptureCancelled(Exception):
+    pass
+
+
+async def _self_timer(seconds: float, cancel_event: Optional[threading.Event]):
+    if cancel_event is None:
+        await asyncio.sleep(seconds)
+    elif await asyncio.to_thread(cancel_event.wait, seconds):
+        raise CaptureCancelled("Capture cancelled during the countdown")
+
+
+async def _traced_download(camera: Camera, capture, index: int) -> Capture:
+    with tracing.span("download", index=index):
+        return await camera.download(capture)
+
+
 async def capture_multiple_photos(
     count: int = 3,
     self_timer_seconds: int = 3,
     before_timer_callback: Optional[Callable[[], None]] = None,
     capture_callback: Optional[Callable[[], None]] = None,
     exception_callback: Optional[Callable[[], None]] = None,
+    saved_callback: Optional[Callable[[Capture], None]] = None,
     camera: Optional[Camera] = None,
-) -> List[Path]:
+    cancel_event: Optional[threading.Event] = None,
+    pressed_at: Optional[float] = None,
+) -> List[Capture]:
     logging.info("Capturing %s photos", count)
-    if camera is None:
+    if pressed_at is None:
+        pressed_at = time.monotonic()
+    owned = camera is None
+    if owned:
         camera = Camera(folder='/tmp')
     await camera.init()
 
-    local_paths = []
+    captures = []
     try:
         logging.info("Blinking led...")
         if before_timer_callback is not None:
             before_timer_callback()
-        await asyncio.sleep(self_timer_seconds)
+        await _self_timer(self_timer_seconds, cancel_event)
 
         for i in range(0, count):
             logging.info("Capturing photo %s...", i + 1)
             if capture_callback is not None:
                 capture_callback()
-            capture = await camera.capture_image()
+            with tracing.span("shutter", index=i):
+                capture = await camera.capture_image()
+            if i == 0:
+                tracing.record("press_to_shutter", pressed_at)
 
             if i < count - 1:
-                logging.info("Blinking led and saving capture %s...", i)
+                logging.info("Blinking led and downloading capture %s...", i)
                 if before_timer_callback is not None:
                     before_timer_callback()
-                _, local_path = await asyncio.gather(
-                    asyncio.sleep(self_timer_seconds),
-                    camera.save(capture),
+                _, downloaded = await asyncio.gather(
+                    _self_timer(self_timer_seconds, cancel_event),
+                    _traced_download(camera, capture, i),
                 )
             else:
-                logging.info("Saving capture %s...", i + 1)
-                local_path = await camera.save(capture)
+                logging.info("Downloading capture %s...", i + 1)
+                downloaded = await _traced_download(camera, capture, i)
 
-            local_paths.append(local_path)
+            if saved_callback is not None:
+                saved_callback(downloaded)
+            captures.append(downloaded)
     except Exception:
         raise
     finally:
         if exception_callback is not None:
             exception_callback()
-        await camera.exit()
-    return local_paths
+        if owned:
+            await camera.exit()
+    return captures
@@ -1,5 +1,5 @@
 from pathlib import Path
-from typing import Any, Dict, List, Optional, Union
+from typing import Any, ClassVar, Dict, List, Literal, Optional, Union
 
 from pydantic import BaseModel
 import yaml
@@ -14,16 +14,16 @@ def _merge_dicts(target, source):
 
 
 class ConfigFromFile(BaseModel):
+    config_files: ClassVar[List[Path]] = [
+        Path("photobooth/app/configs/default.yml"),
+        Path("photobooth/app/configs/presets.yml"),
+        Path("photobooth/app/configs/config.yml"),
+    ]
+
     @classmethod
     def load(cls):
-        config_files = [
-            Path("photobooth/app/configs/default.yml"),
-            Path("photobooth/app/configs/presets.yml"),
-            Path("photobooth/app/configs/config.yml"),
-        ]
-
         config = {}
-        for config_file in config_files:
+        for config_file in cls.config_files:
             if not config_file.is_file():
                 continue
             with open(config_file) as fh:
@@ -36,9 +36,22 @@ class ConfigFromFile(BaseModel):
 
 
 class CameraConfig(BaseModel):
+    class LiveViewConfig(BaseModel):
+        enabled: bool = False
+        host: str = "0.0.0.0"
+        port: int = 8080
+        fps: float = 15
+        max_size: int = 640
+        mirror: bool = False
+        quality: int = 80
+
     count: Union[str, int] = "template"
     delay: int = 3
     output_directory: Path = Path("/tmp/photobooth/captures")
+    keep_alive: int = 60
+    reconnect_attempts: int = 3
+    reconnect_delay: float = 0.5
+    live_view: LiveViewConfig = LiveViewConfig()
 
 
 class FilterConfig(BaseModel):
@@ -57,6 +70,14 @@ class PresetConfig(BaseModel):
     title_filters: List[FilterConfig] = []
 
 
+class EncoderConfig(BaseModel):
+    quality: int = 90
+    subsampling: str = "4:2:0"
+    optimize: bool = False
+    low_memory: bool = False
+    band_height: int = 256
+
+
 class ProcessingConfig(BaseModel):
     class BackgroundConfig(BaseModel):
         color: str = "white"
@@ -70,14 +91,24 @@ class ProcessingConfig(BaseModel):
     filters: Optional[List[FilterConfig]] = []
     title: TitleConfig
     correct_orientation: bool = False
+    pipelined: bool = False
+    # Processes pre-processing captures, 0 for a single thread in the booth process and
+    # None for one per core. Each one imports its own Pillow, numpy and OpenCV.
+    workers: Optional[int] = 0
+    draft: bool = False
+    dpi: int = 300
     tmp_directory: Path = Path("/tmp/photobooth/processing")
     output_directory: Path = Path("/tmp/photobooth/processed")
     output_format: str = "jpg"
+    encoder: EncoderConfig = EncoderConfig()
 
 
 class GpioConfig(BaseModel):
     button: int = 17
     led: int = 27
+    debounce: float = 0.3
+    busy_policy: Literal["ignore", "queue", "cancel"] = "ignore"
+    cooldown: float = 0
 
 
 class PrintingConfig(BaseModel):
@@ -85,16 +116,48 @@ class PrintingConfig(BaseModel):
     copies: int = 1
     delay: int = 0
     destination: Optional[str] = None
+    options: List[str] = []
+    # A job failing this many times is moved out of the queue
+    max_attempts: int = 5
+    queue_directory: Path = Path("/tmp/photobooth/print_queue")
 
 
 class RemoteConfig(BaseModel):
+    # Booth side: serve processed images to the print side
+    serve: bool = False
+    # Only this machine by default, listen on the network together with a token
+    listen_host: str = "127.0.0.1"
+    # Shared by both sides, receivers that do not send it are dropped
+    token: Optional[str] = None
+    ledger: Path = Path("/tmp/photobooth/transferred.log")
+    # Print side: connect to the booth and print what it sends
     host: Optional[str] = None
-    user: Optional[str] = None
-    delay: int = 0
+    port: int = 8765
     local_fetch_directory: Path = Path("/tmp/photobooth/processed")
     local_printed_directory: Path = Path("/tmp/photobooth/printed")
-    remote_output_directory: Path = Path("/tmp/photobooth/processed")
-    remote_printed_directory: Path = Path("/tmp/photobooth/printed")
+
+
+class TracingConfig(BaseModel):
+    enabled: bool = True
+    path: Path = Path("/tmp/photobooth/traces.jsonl")
+
+
+class SessionsConfig(BaseModel):
+    database: Path = Path("/tmp/photobooth/sessions.db")
+    # Process and print again the sessions interrupted by a crash, once started
+    resume: bool = True
+
+
+class GalleryConfig(BaseModel):
+    enabled: bool = False
+    directory: Path = Path("/tmp/photobooth/gallery")
+    thumbnail_size: int = 480
+    thumbnail_format: Literal["webp", "jpg"] = "webp"
+    quality: int = 80
+    serve: bool = True
+    host: str = "0.0.0.0"
+    port: int = 8081
+    page_size: int = 24
 
 
 class PhotoBoothConfig(ConfigFromFile):
@@ -104,3 +167,8 @@ class PhotoBoothConfig(ConfigFromFile):
     printing: PrintingConfig
     presets: Dict[str, PresetConfig]
     remote: RemoteConfig = RemoteConfig()
+    tracing: TracingConfig = TracingConfig()
+    sessions: SessionsConfig = SessionsConfig()
+    gallery: GalleryConfig = GalleryConfig()
+    # Seconds between checks of the config files for changes, 0 to disable
+    reload_interval: float = 2
@@ -0,0 +1,61 @@
+import logging
+from pathlib import Path
+import threading
+from typing import Callable, List, Optional, Tuple
+
+from pydantic import ValidationError
+import yaml
+
+from app.config import PhotoBoothConfig
+
+
+# Checks the modification time of the config files on a timer. A change is loaded and
+# validated off the main path, then handed over; invalid files are logged and skipped.
+class ConfigWatcher:
+    def __init__(
+        self,
+        files: List[Path],
+        load: Callable[[], PhotoBoothConfig],
+        on_change: Callable[[PhotoBoothConfig], None],
+        interval: float = 2,
+    ) -> None:
+        self.files = files
+        self.load = load
+        self.on_change = on_change
+        self.interval = interval
+        self.stop = threading.Event()
+        self.stamp = self._stamp()
+
+    def _stamp(self) -> Tuple[Optional[Tuple[int, int]], ...]:
+        stamps = []
+        for file in self.files:
+            try:
+                stat = file.stat()
+            except FileNotFoundError:
+                stamps.append(None)
+            else:
+                stamps.append((stat.st_mtime_ns, stat.st_size))
+        return tuple(stamps)
+
+    def start(self):
+        threading.Thread(target=self._run, name="config-watcher", daemon=True).start()
+
+    def _run(self):
+        while not self.stop.wait(self.interval):
+            stamp = self._stamp()
+            if stamp == self.stamp:
+                continue
+            self.stamp = stamp
+            self.check()
+
+    def check(self):
+        try:
+            config = self.load()
+        except (OSError, yaml.YAMLError, ValidationError) as e:
+            logging.error("Invalid configuration, keeping the running one: %s", e)
+            return
+        # Whatever fails, the watcher keeps running and picks up the next fix
+        try:
+            self.on_change(config)
+        except Exception as e:
+            logging.error("Invalid configuration, keeping the running one: %s: %s", type(e).__name__, e)
@@ -0,0 +1,159 @@
+from concurrent.futures import Future, ProcessPoolExecutor, ThreadPoolExecutor
+import contextvars
+from dataclasses import dataclass
+import multiprocessing
+from multiprocessing import resource_tracker, shared_memory
+import os
+import threading
+from pathlib import Path
+from typing import Any, Callable, Dict, List, Optional, Tuple, Union
+
+import numpy
+from PIL import Image
+
+from app import tracing
+from app.entities import Capture
+
+
+# Processor instance living in each worker process, built by the pool initializer and
+# rebuilt when a capture comes with a newer configuration version
+_processor = None
+_version = None
+
+
+# Images come back from the workers through shared memory. The segment stays registered
+# with the resource tracker shared by the pool, which unlinks it when the booth exits if
+# it was never read back, a worker dying halfway for instance.
+@dataclass
+class SharedImage:
+    name: str
+    mode: str
+    size: Tuple[int, int]
+    shape: Tuple[int, ...]
+
+    @classmethod
+    def from_image(cls, image) -> "SharedImage":
+        array = numpy.asarray(image, numpy.uint8)
+        buffer = shared_memory.SharedMemory(create=True, size=array.nbytes)
+        try:
+            numpy.ndarray(array.shape, numpy.uint8, buffer=buffer.buf)[:] = array
+        finally:
+            buffer.close()
+        return cls(name=buffer.name, mode=image.mode, size=image.size, shape=array.shape)
+
+    def load(self):
+        buffer = shared_memory.SharedMemory(name=self.name)
+        try:
+            return Image.frombytes(self.mode, self.size, buffer.buf)
+        finally:
+            buffer.close()
+            buffer.unlink()
+
+
+def _init_worker(factory: Callable, version: int):
+    global _processor, _version
+    _processor = factory()
+    _version = version
+
+
+def _pre_process_capture(
+    capture: Union[Path, Capture],
+    factory: Callable,
+    version: int,
+) -> Tuple[SharedImage, List[Dict[str, Any]]]:
+    if version != _version:
+        _init_worker(factory, version)
+    with tracing.collect() as trace:
+        image = _processor.pre_process_capture(capture)
+        if image.mode not in ("L", "RGB", "RGBA"):
+            image = image.convert("RGB")
+        return SharedImage.from_image(image), trace.spans
+
+
+def _resolve(future: Future, pool_future: Future, trace: Optional[tracing.Trace]):
+    if pool_future.cancelled():
+        future.cancel()
+        return
+    try:
+        shared_image, spans = pool_future.result()
+        image = shared_image.load()
+    except BaseException as e:
+        if not future.cancelled():
+            future.set_exception(e)
+        return
+    # Spans recorded in the worker join the trace of the session that submitted the capture
+    if trace is not None:
+        trace.extend(spans)
+    if not future.cancelled():
+        future.set_result(image)
+
+
+class ProcessingEngine:
+    def __init__(self, factory: Callable, workers: Optional[int] = 0, version: int = 0) -> None:
+        self.factory = factory
+        self.workers = os.cpu_count() if workers is None else workers
+        self.version = version
+        # The warm-up and the first session may start the pool at the same time
+        self.lock = threading.Lock()
+        self._processor = None
+        self._executor = None
+
+    def update(self, factory: Callable, version: int):
+        # The pool is kept, workers switch to the new configuration on their next capture
+        self.factory = factory
+        self.version = version
+        with self.lock:
+            self._processor = None
+
+    @property
+    def processor(self):
+        with self.lock:
+            if self._processor is None:
+                self._processor = self.factory()
+            return self._processor
+
+    @property
+    def executor(self):
+        with self.lock:
+            if self._executor is None:
+                self._executor = self._start_executor()
+            return self._executor
+
+    def _start_executor(self):
+        # Without workers, captures are processed on a single background thread
+        if self.workers < 1:
+            return ThreadPoolExecutor(max_workers=1, thread_name_prefix="capture-processing")
+        # Started before the workers so they all share it with this process
+        resource_tracker.ensure_running()
+        # Workers are not forked from the booth process, forking while its other threads
+        # hold locks (logging, camera, print queue) could leave a worker deadlocked
+        return ProcessPoolExecutor(
+            max_workers=self.workers,
+            mp_context=multiprocessing.get_context(
+                "forkserver" if "forkserver" in multiprocessing.get_all_start_methods() else "spawn"
+            ),
+            initializer=_init_worker,
+            initargs=(self.factory, self.version),
+        )
+
+    def submit(self, capture: Union[Path, Capture]) -> Future:
+        if self.workers < 1:
+            context = contextvars.copy_context()
+            return self.executor.submit(context.run, self.processor.pre_process_capture, capture)
+
+        # Capture data is pickled, a copy to shared memory would cost the same and leak
+        # when the capture is cancelled before a worker picks it up
+        future = Future()
+        trace = tracing.current()
+        pool_future = self.executor.submit(_pre_process_capture, capture, self.factory, self.version)
+        future.add_done_callback(lambda future: future.cancelled() and pool_future.cancel())
+        pool_future.add_done_callback(lambda pool_future: _resolve(future, pool_future, trace))
+        return future
+
+    def shutdown(self):
+        with self.lock:
+            executor, self._executor = self._executor, None
+        if executor is not None:
+            # Queued captures are dropped, running ones finish so the workers and the
+            # resource tracker exit cleanly instead of being torn down at exit
+            executor.shutdown(wait=True, cancel_futures=True)
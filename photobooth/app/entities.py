@@ -1,4 +1,6 @@
+from dataclasses import dataclass
 import enum
+from pathlib import Path
 
 
 class PictureOrientation(enum.Enum):
@@ -12,3 +14,11 @@ class PictureFormat(enum.Enum):
     FORMAT_LANDSCAPE_4x3 = (4, 3)
     FORMAT_LANDSCAPE_3x2 = (3, 2)
     FORMAT_PORTRAIT_3x4 = (3, 4)
+
+
+@dataclass
+class Capture:
+    name: str
+    data: bytes
+    # Where the original file is archived
+    path: Path
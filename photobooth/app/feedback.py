@@ -0,0 +1,97 @@
+from dataclasses import dataclass
+import threading
+import time
+from typing import Optional, Sequence, Tuple
+
+
+# A pattern is a list of (offset in seconds, LED state) changes from the moment it starts
+@dataclass(frozen=True)
+class Pattern:
+    steps: Tuple[Tuple[float, bool], ...]
+
+    @property
+    def duration(self) -> float:
+        return self.steps[-1][0] if self.steps else 0
+
+
+def blink(on_time: float, off_time: float, count: int) -> Pattern:
+    steps = []
+    for index in range(count):
+        start = index * (on_time + off_time)
+        steps.append((start, True))
+        steps.append((start + on_time, False))
+    return Pattern(tuple(steps))
+
+
+def flash(duration: float = 1) -> Pattern:
+    return Pattern(((0, True), (duration, False)))
+
+
+def pulse(period: float, duration: float) -> Pattern:
+    return blink(period, period, max(1, round(duration / (2 * period))))
+
+
+def countdown(
+    duration: float,
+    periods: Sequence[float] = (0.5, 0.4, 0.3, 0.25, 0.2, 0.15, 0.1),
+) -> Pattern:
+    # Blinks faster and faster, the last one is cut so the pattern ends on the shutter
+    steps = []
+    offset = 0.0
+    state = False
+    index = 0
+    while offset < duration:
+        state = not state
+        steps.append((offset, state))
+        offset += periods[min(index // 2, len(periods) - 1)]
+        index += 1
+    steps.append((duration, False))
+    return Pattern(tuple(steps))
+
+
+class FeedbackEngine:
+    def __init__(self, led) -> None:
+        self.led = led
+        self.condition = threading.Condition()
+        self.pattern: Optional[Pattern] = None
+        self.started = 0.0
+        self.generation = 0
+        self.thread: Optional[threading.Thread] = None
+
+    def start(self):
+        if self.thread is None:
+            self.thread = threading.Thread(target=self._run, name="feedback", daemon=True)
+            self.thread.start()
+
+    def play(self, pattern: Pattern):
+        # A new pattern replaces the one playing, from now on
+        with self.condition:
+            self.pattern = pattern
+            self.started = time.monotonic()
+            self.generation += 1
+            self.condition.notify()
+
+    def stop(self):
+        self.play(Pattern(((0, False),)))
+
+    def _run(self):
+        while True:
+            with self.condition:
+                while self.pattern is None:
+                    self.condition.wait()
+                pattern, started, generation = self.pattern, self.started, self.generation
+                self.pattern = None
+
+            # Every change is due at a fixed deadline from the start, sleeping late on one
+            # step does not shift the next ones
+            for offset, state in pattern.steps:
+                with self.condition:
+                    deadline = started + offset
+                    while self.generation == generation and time.monotonic() < deadline:
+                        self.condition.wait(deadline - time.monotonic())
+                    if self.generation != generation:
+                        break
+                if state:
+                    self.led.on()
+                else:
+                    self.led.off()
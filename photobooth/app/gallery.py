@@ -0,0 +1,211 @@
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+import html
+import json
+import logging
+import math
+import os
+from pathlib import Path
+import queue
+import threading
+import time
+from typing import Any, Dict, List, Optional
+from urllib.parse import parse_qs, urlsplit
+
+from PIL import Image, features
+
+from app.config import GalleryConfig
+
+
+CONTENT_TYPES = {"webp": "image/webp", "jpg": "image/jpeg"}
+
+PAGE = """<!DOCTYPE html>
+<html><head><meta name="viewport" content="width=device-width, initial-scale=1">
+<style>
+body {{ margin: 0; padding: 1em; background: #111; color: #eee; font-family: sans-serif; }}
+main {{ display: grid; grid-template-columns: repeat(auto-fill, minmax({size}px, 1fr)); gap: 1em; }}
+img {{ width: 100%; }}
+nav {{ margin: 1em 0; text-align: center; }}
+a {{ color: #eee; }}
+</style></head>
+<body><main>
+{items}
+</main><nav>{navigation}</nav></body></html>
+"""
+
+
+# Each processed session gets a thumbnail and a line in an append-only index, written by a
+# background thread once the montage is done. The index is read once at start-up, pages
+# are then served from memory without listing the output directory.
+class Gallery:
+    def __init__(self, settings: GalleryConfig) -> None:
+        self.settings = settings
+        self.index_path = settings.directory / "index.jsonl"
+        self.thumbnail_directory = settings.directory / "thumbnails"
+        self.format = settings.thumbnail_format
+        if self.format == "webp" and not features.check("webp"):
+            logging.warning("Pillow was built without WebP support, thumbnails are JPEG")
+            self.format = "jpg"
+
+        self.lock = threading.Lock()
+        self.entries: List[Dict[str, Any]] = []
+        self.sessions: Dict[str, Dict[str, Any]] = {}
+        self.pending: "queue.Queue[Dict[str, Any]]" = queue.Queue()
+        self.server: Optional[ThreadingHTTPServer] = None
+
+    def start(self):
+        os.makedirs(self.thumbnail_directory, exist_ok=True)
+        self._load()
+        threading.Thread(target=self._run, name="gallery", daemon=True).start()
+        if self.settings.serve:
+            self.server = ThreadingHTTPServer((self.settings.host, self.settings.port), _handler(self))
+            self.server.daemon_threads = True
+            threading.Thread(target=self.server.serve_forever, name="gallery-server", daemon=True).start()
+
+    def add(
+        self,
+        session: str,
+        montage: Path,
+        captures: List[Path],
+        preset: Optional[str],
+        timings: Dict[str, float],
+    ):
+        # Called once the montage is written, the thumbnail is made on the gallery thread
+        self.pending.put(dict(
+            session=session,
+            montage=str(montage),
+            captures=[str(capture) for capture in captures],
+            preset=preset,
+            created_at=time.time(),
+            timings=timings,
+        ))
+
+    def page(self, number: int) -> Dict[str, Any]:
+        # Newest sessions first, pages are numbered from 1
+        size = self.settings.page_size
+        with self.lock:
+            count = len(self.entries)
+            end = max(0, count - (number - 1) * size)
+            entries = self.entries[max(0, end - size):end][::-1]
+        return dict(page=number, pages=max(1, math.ceil(count / size)), count=count, entries=entries)
+
+    def get(self, session: str) -> Optional[Dict[str, Any]]:
+        with self.lock:
+            return self.sessions.get(session)
+
+    def _load(self):
+        if not self.index_path.is_file():
+            return
+        line = "\n"
+        with open(self.index_path) as fh:
+            for line in fh:
+                try:
+                    entry = json.loads(line)
+                except json.JSONDecodeError:
+                    # The last line may be cut if the booth lost power while writing it
+                    continue
+                self._append(entry)
+        if not line.endswith("\n"):
+            # Keeps the next entry off the cut line
+            with open(self.index_path, "a") as fh:
+                fh.write("\n")
+
+    def _append(self, entry: Dict[str, Any]):
+        with self.lock:
+            if entry["session"] in self.sessions:
+                self.entries.remove(self.sessions[entry["session"]])
+            self.entries.append(entry)
+            self.sessions[entry["session"]] = entry
+
+    def _thumbnail(self, entry: Dict[str, Any]):
+        size = self.settings.thumbnail_size
+        path = self.thumbnail_directory / ("%s.%s" % (entry["session"], self.format))
+        with Image.open(entry["montage"]) as image:
+            entry["width"], entry["height"] = image.size
+            # Decoded straight at a reduced DCT scale, then fitted
+            image.draft("RGB", (size, size))
+            image = image.convert("RGB")
+        image.thumbnail((size, size))
+        tmp_path = path.with_name(".%s.part" % path.name)
+        image.save(tmp_path, "WEBP" if self.format == "webp" else "JPEG", quality=self.settings.quality)
+        os.replace(tmp_path, path)
+        entry["thumbnail"] = path.name
+
+    def _run(self):
+        while True:
+            entry = self.pending.get()
+            try:
+                self._thumbnail(entry)
+                with open(self.index_path, "a") as fh:
+                    fh.write(json.dumps(entry) + "\n")
+            except Exception as e:
+                # A bad montage must not stop the thread, later sessions still get in
+                logging.error("Could not add %s to the gallery: %s: %s", entry["montage"], type(e).__name__, e)
+                continue
+            self._append(entry)
+
+
+def _handler(gallery: Gallery):
+    class GalleryHandler(BaseHTTPRequestHandler):
+        def log_message(self, format, *args):
+            logging.debug(format, *args)
+
+        def do_GET(self):
+            url = urlsplit(self.path)
+            try:
+                number = max(1, int(parse_qs(url.query).get("page", ["1"])[0]))
+            except ValueError:
+                number = 1
+
+            if url.path == "/":
+                self._send(200, "text/html; charset=utf-8", self._page(gallery.page(number)).encode())
+            elif url.path == "/index.json":
+                self._send(200, "application/json", json.dumps(gallery.page(number)).encode())
+            elif url.path.startswith("/thumbnails/"):
+                entry = gallery.get(url.path[len("/thumbnails/"):])
+                self._send_file(entry and gallery.thumbnail_directory / entry["thumbnail"])
+            elif url.path.startswith("/photos/"):
+                # Only files of indexed sessions are served, never a path from the request
+                entry = gallery.get(url.path[len("/photos/"):])
+                self._send_file(entry and Path(entry["montage"]))
+            else:
+                self._send(404, "text/plain", b"Not found\n")
+
+        def _page(self, page: Dict[str, Any]) -> str:
+            items = "\n".join(
+                '<a href="/photos/{0}"><img src="/thumbnails/{0}" loading="lazy"></a>'.format(
+                    html.escape(entry["session"]),
+                )
+                for entry in page["entries"]
+            )
+            navigation = []
+            if page["page"] > 1:
+                navigation.append('<a href="/?page=%d">Newer</a>' % (page["page"] - 1))
+            navigation.append("%d / %d" % (page["page"], page["pages"]))
+            if page["page"] < page["pages"]:
+                navigation.append('<a href="/?page=%d">Older</a>' % (page["page"] + 1))
+            return PAGE.format(
+                size=gallery.settings.thumbnail_size // 2,
+                items=items,
+                navigation=" &middot; ".join(navigation),
+            )
+
+        def _send_file(self, path: Optional[Path]):
+            try:
+                if path is None:
+                    raise FileNotFoundError()
+                with open(path, "rb") as fh:
+                    body = fh.read()
+            except OSError:
+                self._send(404, "text/plain", b"Not found\n")
+                return
+            suffix = path.suffix.lower().lstrip(".")
+            self._send(200, CONTENT_TYPES.get(suffix, "image/%s" % suffix), body)
+
+        def _send(self, status: int, content_type: str, body: bytes):
+            self.send_response(status)
+            self.send_header("Content-Type", content_type)
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+    return GalleryHandler
@@ -1,131 +1,189 @@
 import abc
-from dataclasses import dataclass
-from typing import Tuple
+from dataclasses import dataclass, field
+import importlib
+from typing import Dict, List, Optional, Tuple
 
-import cv2
 import numpy
-from PIL import Image, ImageEnhance, ImageOps
+from PIL import Image
+
+
+class _LazyModule:
+    # OpenCV is slow to import, it is only loaded by the first filter using it
+    def __init__(self, name: str) -> None:
+        self.name = name
+        self.module = None
+
+    def __getattr__(self, attribute: str):
+        if self.module is None:
+            self.module = importlib.import_module(self.name)
+        return getattr(self.module, attribute)
+
+
+cv2 = _LazyModule("cv2")
+
+IDENTITY = numpy.arange(256, dtype=numpy.uint8)
+
+
+def bands(array) -> int:
+    return 1 if array.ndim == 2 else array.shape[2]
+
+
+def apply_lut(array, lut):
+    # lut holds one 256 entries table per band, shaped (256, bands)
+    if array.ndim == 2:
+        return cv2.LUT(array, numpy.ascontiguousarray(lut[:, 0]))
+    return cv2.LUT(array, numpy.ascontiguousarray(lut).reshape(256, 1, -1))
+
+
+def _linear_level_channel(values, scale):
+    floor, ceil = scale
+    if ceil <= floor:
+        return numpy.where(values > floor, 255, 0).astype(numpy.uint8)
+    slope = 255 / (ceil - floor)
+    offset = floor * 255 / (floor - ceil)
+    return numpy.maximum(0, numpy.minimum(255 , values * slope + offset)).astype(numpy.uint8)
+
+
+def histogram(values):
+    return numpy.bincount(values.ravel(), minlength=256)
+
+
+def percentile(hist, q: float) -> float:
+    # Same linear interpolation as numpy.percentile, read from a 256 bins histogram
+    cumulated = numpy.cumsum(hist)
+    position = q / 100 * (cumulated[-1] - 1)
+    lower = int(position)
+    upper = min(lower + 1, cumulated[-1] - 1)
+    lower_value, upper_value = numpy.searchsorted(cumulated, [lower, upper], side="right")
+    return lower_value + (position - lower) * (upper_value - lower_value)
 
 
 class ImageFilter(abc.ABC):
+    # Filters work on numpy arrays so a chain of filters only converts the image once.
+    # Per-band point operations also expose a lookup table so they can be fused together.
+    @property
+    def name(self) -> str:
+        return type(self).__name__
+
+    def lut(self, bands: int) -> Optional[numpy.ndarray]:
+        return None
+
+    def process_array(self, array):
+        return apply_lut(array, self.lut(bands(array)))
+
     def process(self, image):
-        pass
+        return Image.fromarray(self.process_array(numpy.asarray(image)))
+
+
+@dataclass
+class LevelFilter(ImageFilter):
+    _luts: Dict[Tuple[float, float], numpy.ndarray] = field(
+        default_factory=dict, init=False, repr=False, compare=False,
+    )
+
+    def _level_lut(self, scale) -> numpy.ndarray:
+        # Only 256 input values are possible, the mapping is computed once per range
+        key = tuple(scale)
+        # Filters are shared between threads, a clear() may land between two lookups
+        lut = self._luts.get(key)
+        if lut is None:
+            lut = _linear_level_channel(IDENTITY, key)
+            if len(self._luts) >= 64:
+                self._luts.clear()
+            self._luts[key] = lut
+        return lut
 
 
 @dataclass
 class BlackAndWhite(ImageFilter):
-    def process(self, image):
-        filter = ImageEnhance.Color(image)
-        return filter.enhance(0)
+    def process_array(self, array):
+        if bands(array) == 1:
+            return array
+        gray = cv2.cvtColor(numpy.ascontiguousarray(array[:, :, :3]), cv2.COLOR_RGB2GRAY)
+        if bands(array) == 4:
+            return cv2.merge((gray, gray, gray, array[:, :, 3]))
+        return cv2.cvtColor(gray, cv2.COLOR_GRAY2RGB)
 
 
 @dataclass
 class Inverted(ImageFilter):
-    def process(self, image):
-        if image.mode == 'RGBA':
-            r, g, b, a = image.split()
-            inverted_image = ImageOps.invert(
-                Image.merge('RGB', (r, g, b))
-            )
-
-            r2, g2, b2 = inverted_image.split()
-            return Image.merge('RGBA', (r2, g2, b2, a))
-        return ImageOps.invert(image)
+    def lut(self, bands: int):
+        lut = numpy.repeat((255 - IDENTITY)[:, None], bands, axis=1)
+        if bands == 4:
+            # Keep transparency untouched
+            lut[:, 3] = IDENTITY
+        return lut
 
 
 @dataclass
-class LevelImage(ImageFilter):
+class LevelImage(LevelFilter):
     black: int = 2
     white: int = 2
     level: int = 0
 
-    def process(self, image):
-        image_array = numpy.asarray(image, numpy.uint8)
-        hsv = cv2.cvtColor(image_array, cv2.COLOR_RGB2HSV)
+    def process_array(self, array):
+        if array.ndim == 2:
+            # A gray image is its own value channel
+            hist = histogram(array)
+            floor = percentile(hist, self.level or self.black)
+            ceil = percentile(hist, 100 - (self.level or self.white))
+            return cv2.LUT(array, self._level_lut((floor, ceil)))
+        hsv = cv2.cvtColor(numpy.ascontiguousarray(array[:, :, :3]), cv2.COLOR_RGB2HSV)
         h,s,v = cv2.split(hsv)
-        floor = numpy.percentile(v, self.level or self.black) # 5% of pixels will be black
-        ceil = numpy.percentile(v, 100 - (self.level or self.white)) # 5% of pixels will be white
-        a = 255 / (ceil - floor)
-        b = floor * 255 / (floor - ceil)
-        v = numpy.maximum(0, numpy.minimum(255 , v * a + b)).astype(numpy.uint8)
+        hist = histogram(v)
+        floor = percentile(hist, self.level or self.black) # 5% of pixels will be black
+        ceil = percentile(hist, 100 - (self.level or self.white)) # 5% of pixels will be white
+        v = cv2.LUT(v, self._level_lut((floor, ceil)))
         hsv = cv2.merge((h,s,v))
-        rgb = cv2.cvtColor(hsv, cv2.COLOR_HSV2RGB)
-
-        return Image.fromarray(rgb)
+        return cv2.cvtColor(hsv, cv2.COLOR_HSV2RGB)
 
 
 @dataclass
-class ColorLevel(ImageFilter):
+class ColorLevel(LevelFilter):
     red: Tuple[int, int] = (0, 255)
     green: Tuple[int, int] = (0, 255)
     blue: Tuple[int, int] = (0, 255)
 
-    @staticmethod
-    def _linear_level_channel(values, scale):
-        floor, ceil = scale
-        slope = 255 / (ceil - floor)
-        offset = floor * 255 / (floor - ceil)
-        return numpy.maximum(0, numpy.minimum(255 , values * slope + offset)).astype(numpy.uint8)
-
-    def process(self, image):
-        if self.red == (0, 255) and self.green == (0, 255) and self.blue == (0, 255):
-            return image
-
-        rgb = numpy.asarray(image, numpy.uint8)
-        r, g, b = cv2.split(rgb)
-
-        if self.red != (0, 255):
-            r = self._linear_level_channel(r, self.red)
-
-        if self.green != (0, 255):
-            g = self._linear_level_channel(g, self.green)
-
-        if self.blue != (0, 255):
-            b = self._linear_level_channel(b, self.blue)
-
-        # Put image back together
-        rgb = cv2.merge((r, g, b))
-        return Image.fromarray(rgb)
+    def lut(self, bands: int):
+        lut = numpy.repeat(IDENTITY[:, None], bands, axis=1)
+        for band, scale in enumerate((self.red, self.green, self.blue)[:bands]):
+            if tuple(scale) != (0, 255):
+                lut[:, band] = self._level_lut(scale)
+        return lut
 
 
 @dataclass
-class AutoColorLevel(ImageFilter):
-    threshold: int = 0
-
-    def _compute_range(self, values):
-        hist, _ = numpy.histogram(values, bins=256)
-        return (
-            (hist < self.threshold).sum(),
-            (hist > (255 - self.threshold)).sum(),
-        )
-
-    @staticmethod
-    def _linear_level_channel(values, scale):
-        floor, ceil = scale
-        slope = 255 / (ceil - floor)
-        offset = floor * 255 / (floor - ceil)
-        return numpy.maximum(0, numpy.minimum(255 , values * slope + offset)).astype(numpy.uint8)
-
-    def process(self, image):
-        rgb = numpy.asarray(image, numpy.uint8)
-        r, g, b = cv2.split(rgb)
-
-        scales = (
-            self._compute_range(r),
-            self._compute_range(g),
-            self._compute_range(b),
-        )
-
-        r = self._linear_level_channel(r, scales[0])
-        g = self._linear_level_channel(g, scales[1])
-        b = self._linear_level_channel(b, scales[2])
-
-        # Put image back together
-        rgb = cv2.merge((r, g, b))
-        return Image.fromarray(rgb)
+class AutoColorLevel(LevelFilter):
+    # Percentage of the pixels clipped to black and to white on each channel
+    threshold: float = 0
+    # Black and white points are estimated on about this many pixels, taken on a regular
+    # grid, so their cost does not grow with the resolution. 0 uses every pixel.
+    samples: int = 250000
+
+    def sample(self, array):
+        height, width = array.shape[:2]
+        step = max(1, int((height * width / self.samples) ** 0.5)) if self.samples else 1
+        if array.ndim == 2:
+            return array[::step, ::step, None]
+        return array[::step, ::step, :3]
+
+    def levels(self, array) -> List[Tuple[float, float]]:
+        # One bincount for the three channels, each shifted to its own 256 bins
+        sample = self.sample(array)
+        offsets = numpy.arange(0, 256 * sample.shape[2], 256, dtype=numpy.uint16)
+        hists = numpy.bincount((sample + offsets).ravel(), minlength=256 * sample.shape[2]).reshape(-1, 256)
+        return [(percentile(hist, self.threshold), percentile(hist, 100 - self.threshold)) for hist in hists]
+
+    def process_array(self, array):
+        lut = numpy.repeat(IDENTITY[:, None], bands(array), axis=1)
+        for band, scale in enumerate(self.levels(array)):
+            lut[:, band] = self._level_lut(scale)
+
+        # A single lookup for all the channels, no split and merge
+        return apply_lut(array, lut)
 
 
 @dataclass
 class MirrorImage(ImageFilter):
-    def process(self, image):
-        return image.transpose(Image.Transpose.FLIP_LEFT_RIGHT)
+    def process_array(self, array):
+        return cv2.flip(array, 1)
@@ -1,18 +1,84 @@
-from typing import List, Tuple
+from typing import Dict, List, Tuple, Union
 
+import numpy
+from PIL import Image
+
+from app import tracing
 from app.image_filters import ImageFilter
 
 
-def apply_filters(image, filters: List[ImageFilter]):
-    for filter in filters:
-        image = filter.process(image)
-    return image
+class FusedLut(ImageFilter):
+    def __init__(self, filters: List[ImageFilter]) -> None:
+        self.filters = filters
+        self.luts: Dict[int, numpy.ndarray] = {}
+
+    def __repr__(self) -> str:
+        return self.name
+
+    @property
+    def name(self) -> str:
+        return "+".join(filter.name for filter in self.filters)
+
+    def lut(self, bands: int):
+        if bands not in self.luts:
+            lut = self.filters[0].lut(bands)
+            for filter in self.filters[1:]:
+                lut = numpy.take_along_axis(filter.lut(bands), lut.astype(numpy.intp), axis=0)
+            self.luts[bands] = lut
+        return self.luts[bands]
+
+
+class FilterPipeline:
+    def __init__(self, filters: List[ImageFilter]) -> None:
+        self.filters = filters
+        self.steps = self._compile(filters)
+
+    @staticmethod
+    def _compile(filters: List[ImageFilter]) -> List[ImageFilter]:
+        # Consecutive lookup table filters are folded into a single table per band
+        steps = []
+        luts = []
+        for filter in filters:
+            if filter.lut(3) is not None:
+                luts.append(filter)
+                continue
+            if luts:
+                steps.append(FusedLut(luts))
+                luts = []
+            steps.append(filter)
+        if luts:
+            steps.append(FusedLut(luts))
+        return steps
+
+    def process(self, image):
+        if not self.steps:
+            return image
+        if image.mode not in ("L", "RGB", "RGBA"):
+            has_alpha = "A" in image.getbands() or "transparency" in image.info
+            image = image.convert("RGBA" if has_alpha else "RGB")
+
+        # The image stays in a single array from the first filter to the last
+        array = numpy.asarray(image)
+        for step in self.steps:
+            with tracing.span("filter:%s" % step.name):
+                array = step.process_array(array)
+        return Image.fromarray(array)
+
+
+def apply_filters(image, filters: Union[FilterPipeline, List[ImageFilter]]):
+    if not isinstance(filters, FilterPipeline):
+        filters = FilterPipeline(filters)
+    return filters.process(image)
 
 
 def ensure_size(image, size, keep_proportions: bool = False):
     if image.size == size:
         return image
     if keep_proportions:
+        # Already fitted in the target size
+        width, height = image.size
+        if (width == size[0] and height <= size[1]) or (height == size[1] and width <= size[0]):
+            return image
         resized_size = resized(size, image.size, crop=True)
         size = (
             min(resized_size[0], size[0]),
@@ -0,0 +1,65 @@
+import logging
+import queue
+import threading
+import time
+from typing import Callable, Optional
+
+from app.config import GpioConfig
+
+
+# Presses are debounced and turned into sessions run one at a time by a worker thread, so
+# the input callback returns right away. While a session runs, presses follow the busy
+# policy: "ignore" drops them, "queue" keeps one for the next session and "cancel" aborts
+# the countdown of the running session. Out of a countdown, "cancel" ignores presses.
+class InputController:
+    def __init__(self, session: Callable[[float], None], settings: GpioConfig) -> None:
+        self.session = session
+        self.settings = settings
+        self.lock = threading.Lock()
+        self.pending: "queue.Queue[float]" = queue.Queue(maxsize=1)
+        self.cancel = threading.Event()
+        # Set by the session while a countdown runs, the only time it can be cancelled
+        self.countdown = threading.Event()
+        self.busy = False
+        self.last_press = float("-inf")
+        self.thread: Optional[threading.Thread] = None
+
+    def start(self):
+        if self.thread is None:
+            self.thread = threading.Thread(target=self._run, name="input", daemon=True)
+            self.thread.start()
+
+    def press(self):
+        now = time.monotonic()
+        with self.lock:
+            if now - self.last_press < self.settings.debounce:
+                return
+            self.last_press = now
+
+            if not self.busy or self.settings.busy_policy == "queue":
+                try:
+                    self.pending.put_nowait(now)
+                except queue.Full:
+                    logging.info("A session is already waiting, press ignored")
+            elif self.settings.busy_policy == "cancel" and self.countdown.is_set():
+                logging.info("Cancelling the running session")
+                self.cancel.set()
+            else:
+                logging.info("Session in progress, press ignored")
+
+    def _run(self):
+        while True:
+            pressed_at = self.pending.get()
+            with self.lock:
+                self.busy = True
+                self.cancel.clear()
+            logging.debug("Starting session %.3fs after the press", time.monotonic() - pressed_at)
+            try:
+                self.session(pressed_at)
+            except Exception as e:
+                logging.error(e)
+            # Keeps a crowd hitting the button from chaining sessions back to back
+            time.sleep(self.settings.cooldown)
+            with self.lock:
+                self.busy = False
+                self.countdown.clear()
@@ -0,0 +1,165 @@
+from collections import deque
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+import io
+import logging
+import threading
+import time
+from typing import Deque, Optional, Tuple
+
+from PIL import Image, ImageOps
+
+from app.camera import Camera
+from app.config import CameraConfig
+
+
+BOUNDARY = "frame"
+
+PAGE = b"""<!DOCTYPE html>
+<html><body style="margin:0;background:black">
+<img src="/stream.mjpg" style="width:100vw;height:100vh;object-fit:contain">
+</body></html>
+"""
+
+
+class LiveView:
+    # Only the latest frames are kept, a slow viewer skips frames instead of queueing them
+    buffer_size: int = 2
+    error_delay: float = 1
+
+    def __init__(self, camera: Camera, settings: CameraConfig.LiveViewConfig) -> None:
+        self.camera = camera
+        self.settings = settings
+        self.frames: Deque[Tuple[int, bytes]] = deque(maxlen=self.buffer_size)
+        self.condition = threading.Condition()
+        self.sequence = 0
+
+        self.running = threading.Event()
+        self.idle = threading.Event()
+        self.idle.set()
+        self.server: Optional[ThreadingHTTPServer] = None
+
+    def start(self):
+        threading.Thread(target=self._run, name="live-view", daemon=True).start()
+        self.server = ThreadingHTTPServer((self.settings.host, self.settings.port), _handler(self))
+        self.server.daemon_threads = True
+        threading.Thread(target=self.server.serve_forever, name="live-view-server", daemon=True).start()
+        self.resume()
+
+    def resume(self):
+        self.running.set()
+
+    def pause(self, timeout: float = 1):
+        # Waits for the frame being transferred, the camera is free for the shutter after
+        self.running.clear()
+        self.idle.wait(timeout)
+
+    def latest(self) -> Optional[Tuple[int, bytes]]:
+        with self.condition:
+            return self.frames[-1] if self.frames else None
+
+    def wait_frame(self, after: int, timeout: float = 5) -> Optional[Tuple[int, bytes]]:
+        with self.condition:
+            self.condition.wait_for(lambda: self.sequence > after, timeout)
+            return self.frames[-1] if self.frames and self.sequence > after else None
+
+    def _reduce(self, data: bytes) -> bytes:
+        max_size = self.settings.max_size
+        with Image.open(io.BytesIO(data)) as image:
+            if max(image.size) <= max_size and not self.settings.mirror:
+                return data
+            # Decoded straight at a reduced DCT scale, then fitted
+            image.draft("RGB", (max_size, max_size))
+            image = image.convert("RGB")
+        image.thumbnail((max_size, max_size))
+        if self.settings.mirror:
+            image = ImageOps.mirror(image)
+        buffer = io.BytesIO()
+        image.save(buffer, "JPEG", quality=self.settings.quality)
+        return buffer.getvalue()
+
+    def _run(self):
+        interval = 1 / self.settings.fps
+        deadline = time.monotonic()
+        while True:
+            if not self.running.is_set():
+                self.running.wait()
+                deadline = time.monotonic()
+
+            self.idle.clear()
+            try:
+                if self.running.is_set():
+                    data = self.camera.capture_preview()
+                else:
+                    data = None
+            except Exception as e:
+                logging.warning("Live view frame failed: %s", e)
+                data = None
+                deadline = time.monotonic() + self.error_delay
+            finally:
+                self.idle.set()
+
+            if data is not None:
+                try:
+                    frame = self._reduce(data)
+                except OSError as e:
+                    logging.warning("Invalid live view frame: %s", e)
+                else:
+                    with self.condition:
+                        self.sequence += 1
+                        self.frames.append((self.sequence, frame))
+                        self.condition.notify_all()
+
+            # Frames are paced on fixed deadlines, a late frame is not caught up on
+            deadline = max(deadline + interval, time.monotonic())
+            self.running.wait()
+            time.sleep(max(0, deadline - time.monotonic()))
+
+
+def _handler(live_view: LiveView):
+    class LiveViewHandler(BaseHTTPRequestHandler):
+        def log_message(self, format, *args):
+            logging.debug(format, *args)
+
+        def do_GET(self):
+            if self.path == "/":
+                self._send(200, "text/html", PAGE)
+            elif self.path == "/frame.jpg":
+                frame = live_view.latest()
+                if frame is None:
+                    self._send(503, "text/plain", b"No frame yet\n")
+                else:
+                    self._send(200, "image/jpeg", frame[1])
+            elif self.path == "/stream.mjpg":
+                self._stream()
+            else:
+                self._send(404, "text/plain", b"Not found\n")
+
+        def _send(self, status: int, content_type: str, body: bytes):
+            self.send_response(status)
+            self.send_header("Content-Type", content_type)
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def _stream(self):
+            self.send_response(200)
+            self.send_header("Cache-Control", "no-cache")
+            self.send_header("Content-Type", "multipart/x-mixed-replace; boundary=%s" % BOUNDARY)
+            self.end_headers()
+            sequence = 0
+            try:
+                while True:
+                    frame = live_view.wait_frame(sequence)
+                    if frame is None:
+                        # Paused, the stream stays open until frames come back
+                        continue
+                    sequence, data = frame
+                    self.wfile.write(b"--%s\r\n" % BOUNDARY.encode())
+                    self.wfile.write(b"Content-Type: image/jpeg\r\n")
+                    self.wfile.write(b"Content-Length: %d\r\n\r\n" % len(data))
+                    self.wfile.write(data)
+                    self.wfile.write(b"\r\n")
+            except (BrokenPipeError, ConnectionResetError):
+                pass
+
+    return LiveViewHandler
@@ -1,7 +1,9 @@
 from pathlib import Path
-from typing import List
+from typing import List, Union
 from statemachine import State, StateMachine
 
+from app.entities import Capture
+
 
 class PhotoBoothMachine(StateMachine):
     initialization = State(initial=True)
@@ -18,7 +20,7 @@ class PhotoBoothMachine(StateMachine):
     captured = capturing.to(processing)
     processed = processing.to(printing)
     printed = printing.to(waiting)
-    failed = capturing.to(waiting)
+    failed = capturing.to(waiting) | processing.to(waiting)
 
     def __init__(self):
         super().__init__()
@@ -26,7 +28,7 @@ class PhotoBoothMachine(StateMachine):
     def if_button_pressed(self, pressed: bool) -> bool:
         return pressed
 
-    def on_captured(self, captures: List[Path]):
+    def on_captured(self, captures: List[Union[Path, Capture]]):
         self.images_to_process = captures
 
     def on_processed(self, processed_image: Path):
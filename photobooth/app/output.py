@@ -0,0 +1,108 @@
+import io
+from pathlib import Path
+import struct
+from typing import Callable, Tuple
+
+from app.config import EncoderConfig
+
+
+JPEG_EXTENSIONS = (".jpg", ".jpeg")
+
+# Bands are a multiple of the largest JPEG MCU height so they can be stitched together
+MCU_HEIGHT = 16
+
+SOF_MARKERS = (0xC0, 0xC1)
+SOS_MARKER = 0xDA
+EOI = b"\xff\xd9"
+
+
+def _jpeg_options(settings: EncoderConfig) -> dict:
+    return dict(
+        quality=settings.quality,
+        subsampling=settings.subsampling,
+        optimize=settings.optimize,
+        progressive=False,
+    )
+
+
+def save_image(image, path: Path, settings: EncoderConfig):
+    if Path(path).suffix.lower() in JPEG_EXTENSIONS:
+        image.save(path, **_jpeg_options(settings))
+    else:
+        image.save(path)
+
+
+def _split_jpeg(data: bytes) -> Tuple[bytes, bytes]:
+    # Headers up to the start of scan segment, and the entropy coded data until EOI
+    position = 2
+    while True:
+        marker = data[position + 1]
+        length = struct.unpack(">H", data[position + 2:position + 4])[0]
+        position += 2 + length
+        if marker == SOS_MARKER:
+            return data[:position], data[position:data.rindex(EOI)]
+
+
+def _set_height(header: bytes, height: int) -> bytes:
+    header = bytearray(header)
+    position = 2
+    while True:
+        marker = header[position + 1]
+        length = struct.unpack(">H", header[position + 2:position + 4])[0]
+        if marker in SOF_MARKERS:
+            header[position + 5:position + 7] = struct.pack(">H", height)
+            return bytes(header)
+        position += 2 + length
+
+
+class _RestartMarkers:
+    def __init__(self) -> None:
+        self.count = 0
+
+    def next(self) -> int:
+        marker = 0xD0 + self.count % 8
+        self.count += 1
+        return marker
+
+    def renumber(self, scan: bytes) -> bytes:
+        scan = bytearray(scan)
+        position = scan.find(b"\xff")
+        while position >= 0:
+            if 0xD0 <= scan[position + 1] <= 0xD7:
+                scan[position + 1] = self.next()
+            position = scan.find(b"\xff", position + 2)
+        return bytes(scan)
+
+
+def save_banded(
+    render_band: Callable[[int, int], object],
+    size: Tuple[int, int],
+    path: Path,
+    settings: EncoderConfig,
+):
+    width, height = size
+    if Path(path).suffix.lower() not in JPEG_EXTENSIONS:
+        return save_image(render_band(0, height), path, settings)
+
+    # Each band is encoded as a JPEG with a restart marker after every MCU row. Since
+    # quantization and Huffman tables are the same for every band, their scans can be
+    # chained after the headers of the first band, renumbering the restart markers.
+    band_height = max(MCU_HEIGHT, settings.band_height // MCU_HEIGHT * MCU_HEIGHT)
+    markers = _RestartMarkers()
+    with open(path, "wb") as fh:
+        for top in range(0, height, band_height):
+            bottom = min(top + band_height, height)
+            buffer = io.BytesIO()
+            render_band(top, bottom).save(
+                buffer,
+                "JPEG",
+                restart_marker_rows=1,
+                **dict(_jpeg_options(settings), optimize=False),
+            )
+            header, scan = _split_jpeg(buffer.getvalue())
+            if top == 0:
+                fh.write(_set_height(header, height))
+            else:
+                fh.write(bytes((0xFF, markers.next())))
+            fh.write(markers.renumber(scan))
+        fh.write(EOI)
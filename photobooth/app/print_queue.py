@@ -0,0 +1,157 @@
+from collections import OrderedDict
+import json
+import logging
+import os
+from pathlib import Path
+import threading
+import time
+from typing import Dict, Optional, Set
+
+from app.config import PrintingConfig
+from app.printer import print_image
+
+
+# Print jobs are kept as small JSON files in the queue directory until they have been
+# handed to the printer, so pending prints survive a restart of the service. Jobs submitted
+# with a key, the session they print, are only ever printed once: the keys of printed
+# jobs are kept in printed.log.
+class PrintQueue:
+    retry_delay: float = 5
+
+    def __init__(self, directory: Path, settings: PrintingConfig) -> None:
+        self.directory = Path(directory)
+        self.settings = settings
+        self.condition = threading.Condition()
+        self.jobs: "OrderedDict[str, Dict]" = OrderedDict()
+        self.printing: Optional[str] = None
+        self.thread: Optional[threading.Thread] = None
+        self.printed_log = self.directory / "printed.log"
+        self.printed: Set[str] = set()
+
+        os.makedirs(self.directory, exist_ok=True)
+        self._load()
+
+
+    def _load(self):
+        for job_file in sorted(self.directory.glob("*.json")):
+            try:
+                with open(job_file) as fh:
+                    job = json.load(fh)
+            except (OSError, ValueError) as e:
+                logging.error("Dropping unreadable print job %s: %s", job_file, e)
+                job_file.unlink(missing_ok=True)
+                continue
+            job["file"] = str(job_file)
+            job.setdefault("attempts", 0)
+            self.jobs[job["file"]] = job
+        if self.jobs:
+            logging.info("Resuming %s print jobs", len(self.jobs))
+        if self.printed_log.is_file():
+            with open(self.printed_log) as fh:
+                self.printed.update(line.strip() for line in fh if line.strip())
+
+    @staticmethod
+    def _save(job: Dict):
+        job_file = Path(job["file"])
+        tmp_file = job_file.with_suffix(".tmp")
+        with open(tmp_file, "w") as fh:
+            json.dump({key: job.get(key) for key in ("image_path", "copies", "attempts", "key")}, fh)
+        os.replace(tmp_file, job_file)
+
+    @property
+    def depth(self) -> int:
+        with self.condition:
+            return len(self.jobs)
+
+    def start(self):
+        if self.thread is not None:
+            return
+        self.thread = threading.Thread(target=self._run, name="print-queue", daemon=True)
+        self.thread.start()
+
+    def submit(self, image_path: Path, copies: Optional[int] = None, key: Optional[str] = None) -> int:
+        copies = copies or self.settings.copies or 1
+        with self.condition:
+            if key is not None and (key in self.printed or any(job.get("key") == key for job in self.jobs.values())):
+                logging.info("%s is already queued or printed", key)
+                return len(self.jobs)
+            pending = [
+                job for file, job in self.jobs.items()
+                if job["image_path"] == str(image_path) and file != self.printing and job.get("key") is None
+            ] if key is None else []
+            if pending:
+                # Duplicate jobs for the same image are collapsed into more copies
+                job = pending[0]
+                job["copies"] += copies
+            else:
+                job = {
+                    "image_path": str(image_path),
+                    "copies": copies,
+                    "attempts": 0,
+                    "key": key,
+                    "file": str(self.directory / ("%s.json" % time.time_ns())),
+                }
+                self.jobs[job["file"]] = job
+            self._save(job)
+            self.condition.notify()
+            return len(self.jobs)
+
+    def _run(self):
+        while True:
+            with self.condition:
+                while not self.jobs:
+                    self.condition.wait()
+                key, job = next(iter(self.jobs.items()))
+                self.printing = key
+                image_path = Path(job["image_path"])
+                copies = job["copies"]
+
+            started = time.monotonic()
+            if not image_path.is_file():
+                logging.error("%s does not exist anymore", image_path)
+                result = None
+            else:
+                try:
+                    result = print_image(image_path, format=None, settings=self.settings, copies=copies)
+                except Exception as e:
+                    logging.error(e)
+                    result = -1
+
+            with self.condition:
+                self.printing = None
+                if result is None:
+                    self._park(key)
+                elif result != 0:
+                    job["attempts"] += 1
+                    if job["attempts"] >= self.settings.max_attempts:
+                        logging.error("Could not print %s after %s attempts", image_path, job["attempts"])
+                        self._park(key)
+                    else:
+                        # Moved behind the other jobs, one bad image does not hold them up
+                        logging.error("Could not print %s, retrying in %ss", image_path, self.retry_delay)
+                        self.jobs.move_to_end(key)
+                        self._save(job)
+                else:
+                    if job.get("key") is not None:
+                        # Recorded before the job file goes, a crash in between does not print it again
+                        with open(self.printed_log, "a") as fh:
+                            fh.write(job["key"] + "\n")
+                        self.printed.add(job["key"])
+                    del self.jobs[key]
+                    Path(key).unlink(missing_ok=True)
+                    logging.info(
+                        "Printed %s in %.2fs (%s left in queue)",
+                        image_path, time.monotonic() - started, len(self.jobs),
+                    )
+
+            if result is not None:
+                time.sleep(self.retry_delay if result != 0 else self.settings.delay)
+
+    def _park(self, key: str):
+        # Failed jobs are kept aside in failed/, to be looked at or moved back by hand
+        job = self.jobs.pop(key)
+        failed_directory = self.directory / "failed"
+        os.makedirs(failed_directory, exist_ok=True)
+        self._save(job)
+        os.replace(job["file"], failed_directory / Path(job["file"]).name)
+        logging.error("Print job for %s moved to %s", job["image_path"], failed_directory)
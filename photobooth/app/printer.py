@@ -1,6 +1,7 @@
 import platform
 from pathlib import Path
 import subprocess
+from typing import Optional
 
 from app.config import PrintingConfig
 from app.entities import PictureFormat
@@ -9,20 +10,25 @@ def print_image(
     image_path: Path,
     format: PictureFormat,
     settings: PrintingConfig,
-):
+    copies: Optional[int] = None,
+) -> int:
     os_name = platform.system()
+    copies = copies or settings.copies
 
     command = None
     options = []
     if os_name in ["Linux", "Darwin"]:
         command = "lp"
-        if settings.copies and settings.copies > 1:
+        if copies and copies > 1:
             options.append("-n")
-            options.append(settings.copies)
+            options.append(str(copies))
         if settings.destination:
             options.append("-d")
             options.append(settings.destination)
+        for option in settings.options:
+            options.append("-o")
+            options.append(option)
     else:
         raise OSError("Unsupported operating system: %s" % os_name)
 
-    subprocess.call([command, *options, image_path])
+    return subprocess.call([command, *options, image_path])
@@ -1,12 +1,19 @@
-from functools import cached_property, lru_cache
+from concurrent.futures import Future
+from functools import cached_property, partial
+import io
+import json
+import logging
+import os
 from pathlib import Path
 from PIL import Image, ImageOps
-from typing import List
+from typing import Any, Callable, Dict, List, Optional, Tuple, Union
 
-from app import image_filters, templates
-from app.config import ProcessingConfig, TemplateConfig
+from app import registry, tracing
+from app.config import FilterConfig, PresetConfig, ProcessingConfig
+from app.engine import ProcessingEngine
 from app.image_helpers import apply_filters, ensure_size, min_common_size, resized
-from app.entities import PictureFormat, PictureOrientation
+from app.entities import Capture, PictureFormat, PictureOrientation
+from app.output import save_banded, save_image
 
 
 def get_orientation(image) -> PictureOrientation:
@@ -63,84 +70,226 @@ def normalize_images(
     return images, common_size
 
 
-def load_image(path: Path):
-    with Image.open(path) as image:
+def load_image(source: Union[Path, Capture], draft_size: Optional[Tuple[int, int]] = None):
+    # Captures downloaded to memory are decoded without going through the disk
+    if isinstance(source, Capture):
+        source = io.BytesIO(source.data)
+    with Image.open(source) as image:
+        if draft_size is not None:
+            # JPEG files are decoded straight to the smallest DCT scale still covering
+            # the requested size, whatever the orientation of the capture
+            side = max(draft_size)
+            image.draft(image.mode, (side, side))
         image.load()
     return image
 
 
 class CaptureProcessor:
-    def __init__(self, settings: ProcessingConfig, presets: List[TemplateConfig]) -> None:
+    def __init__(self, settings: ProcessingConfig, presets: Dict[str, PresetConfig]) -> None:
+        self._titles: Dict[Tuple, Any] = {}
+        # Last key seen for a title file and its filters
+        self._title_keys: Dict[Tuple[str, str], Tuple] = {}
+        self._backgrounds: Dict[Tuple, Any] = {}
+        self.version = 0
+        self.configure(settings, presets)
+
+    def configure(self, settings: ProcessingConfig, presets: Dict[str, PresetConfig]):
+        # Everything is resolved and validated before being swapped in, an invalid
+        # configuration leaves the processor as it was
+        preset = registry.resolve(settings, presets)
+        template = registry.template(preset.template)
+        capture_filters = registry.filter_pipeline(preset.filters)
+        title_filters = registry.filter_pipeline(preset.title_filters)
+
+        # A different number of workers needs a new pool, started on the next capture
+        if "engine" in self.__dict__ and settings.workers != self.settings.workers:
+            self.engine.shutdown()
+            del self.engine
+
         self.settings = settings
         self.presets = presets
+        self.preset = preset
+        self.template = template
+        self.capture_filters = capture_filters
+        self.title_filters = title_filters
+        self.capture_size = template.capture_size(settings.dpi) if settings.draft else None
+        self.version += 1
 
-    @cached_property
-    def template(self) -> templates.MontageTemplate:
-        try:
-            template = self.settings.template or self.presets[self.settings.preset].template
-            return getattr(templates, template.name)(**template.params)
-        except Exception as e:
-            raise Exception("Could not find template from provided configuration") from e
+        # Workers rebuild their processor when they see a new version
+        if "engine" in self.__dict__:
+            self.engine.update(partial(CaptureProcessor, settings, presets), self.version)
 
     @property
-    def capture_filters(self):
-        filters = self.settings.filters
-        if not filters:
-            filters = self.presets[self.settings.preset].filters
-        return [
-            getattr(image_filters, filter.name)(**filter.params)
-            for filter in filters
-        ]
+    def title_filters_config(self) -> List[FilterConfig]:
+        return self.preset.title_filters
 
-    @property
-    def title_filters(self):
-        filters = self.settings.title.filters
-        if not filters:
-            filters = self.presets[self.settings.preset].title_filters
-        return [
-            getattr(image_filters, filter.name)(**filter.params)
-            for filter in filters
-        ]
+    @cached_property
+    def engine(self) -> ProcessingEngine:
+        return ProcessingEngine(
+            partial(CaptureProcessor, self.settings, self.presets),
+            workers=self.settings.workers,
+            version=self.version,
+        )
+
+    def start_session(self) -> "ProcessingSession":
+        return ProcessingSession(self)
 
     def process(
         self,
-        captures: List[Path],
+        captures: List[Union[Path, Capture]],
         output_file_path: Path,
     ):
-        processed_images = self._pre_process_captures(captures)
-        title_image = self._pre_process_title()
+        session = self.start_session()
+        for capture in captures:
+            session.submit(capture)
+        session.process(output_file_path)
 
-        montage = self.template.process(processed_images, title_image)
-        montage.save(output_file_path)
+    def pre_process_capture(self, capture: Union[Path, Capture]):
+        with tracing.span("decode"):
+            image = load_image(capture, draft_size=self.capture_size)
 
-    def _pre_process_captures(
-        self,
-        captures: List[Path],
-    ):
-        images = [load_image(path) for path in captures]
+        with tracing.span("crop"):
+            # Make sure the image is in the right orientation
+            image = ImageOps.exif_transpose(image)
+
+            if self.settings.correct_orientation:
+                image = ensure_orientation(image, self.template.orientation)
 
-        # Make sure images are in the right orientation
-        images = [ImageOps.exif_transpose(image) for image in images]
+            # Crop image to the right format
+            image = ensure_format(image, self.template.capture_format)
 
-        if self.settings.correct_orientation:
-            images = [ensure_orientation(image, self.template.orientation) for image in images]
+            # Scale the capture down to its size in the printed montage
+            if self.capture_size is not None:
+                image = ensure_size(image, self.capture_size)
 
-        # Crop images to the right format
-        images = [ensure_format(image, self.template.capture_format) for image in images]
+        # Apply filters on capture. They run before the common size resize in _assemble so
+        # each capture is filtered while the next one is shot. Captures of one camera are
+        # cropped to the same format and already share their size, the resize only evens
+        # out a pixel of rounding, and the filters are point or histogram operations
+        # or a mirror, which give the same picture either way.
+        return apply_filters(image, self.capture_filters)
 
+    def _assemble(self, images, output_file_path: Path):
         # Resize all images to the same size
         common_size = min_common_size(images)
         images = [ensure_size(image, common_size) for image in images]
 
-        # Apply filters on captures
-        images = [apply_filters(image, self.capture_filters) for image in images]
+        if self.settings.encoder.low_memory:
+            # The montage is rendered and encoded band by band, never as a whole
+            layout = self.template.layout(common_size)
+            title_image = self.title(self.template.title_size(common_size))
+            # Bands are rendered while encoding, the span covers both
+            with tracing.span("encode", banded=True):
+                save_banded(
+                    lambda top, bottom: self.template.render(layout, images, title_image, top, bottom),
+                    layout.size,
+                    output_file_path,
+                    self.settings.encoder,
+                )
+        else:
+            with tracing.span("montage"):
+                montage = self.template.process(images, background=self.background(common_size))
+            with tracing.span("encode"):
+                save_image(montage, output_file_path, self.settings.encoder)
+
+    def warm_up(self, dummy: bool = False):
+        if self.capture_size is not None and not self.settings.encoder.low_memory:
+            self.background(self.capture_size)
+        else:
+            self.title()
+        if dummy:
+            self._warm_up_pipeline()
 
-        return images
+    def _warm_up_pipeline(self):
+        # A small capture per worker goes through decode, filters, montage and encode, so
+        # the first guest does not pay for imports, worker start-up and first calls
+        buffer = io.BytesIO()
+        Image.new("RGB", self.template.capture_size(self.settings.dpi), "gray").save(buffer, "JPEG")
+        capture = Capture(name="warm-up.jpg", data=buffer.getvalue(), path=Path(os.devnull))
+        futures = [self.engine.submit(capture) for _ in range(max(1, self.engine.workers))]
+        images = [future.result() for future in futures]
 
-    @lru_cache
-    def _pre_process_title(self):
-        if not self.settings.title:
+        os.makedirs(self.settings.tmp_directory, exist_ok=True)
+        output_file_path = self.settings.tmp_directory / ("warm-up.%s" % self.settings.output_format)
+        try:
+            self._assemble(images[:1] * self.template.capture_count, output_file_path)
+        finally:
+            output_file_path.unlink(missing_ok=True)
+
+    @staticmethod
+    def _cached(cache: Dict[Tuple, Any], key: Tuple, render: Callable, maxsize: int):
+        # Read once and returned from a local, another thread may clear the cache meanwhile
+        value = cache.get(key)
+        if value is None:
+            value = render()
+            if len(cache) >= maxsize:
+                cache.clear()
+            cache[key] = value
+        return value
+
+    def _title_key(self) -> Optional[Tuple]:
+        # Rendered titles are kept until the title file or its filters change
+        image_path = self.settings.title.image_path
+        if image_path is None:
             return None
-        with Image.open(self.settings.title.image_path) as title:
+        filters = json.dumps([filter.model_dump() for filter in self.title_filters_config], sort_keys=True)
+        try:
+            key = (str(image_path), os.stat(image_path).st_mtime_ns, filters)
+        except OSError as e:
+            # A title being replaced or gone for a moment keeps the one already rendered
+            key = self._title_keys.get((str(image_path), filters))
+            if key is None:
+                raise
+            logging.warning("Using the title rendered before: %s: %s", type(e).__name__, e)
+            return key
+        self._title_keys[(str(image_path), filters)] = key
+        return key
+
+    def title(self, size: Optional[Tuple[int, int]] = None):
+        title_key = self._title_key()
+        if title_key is None:
+            return None
+
+        if size is None:
+            render = lambda: self._pre_process_title(self.settings.title.image_path)
+        else:
+            # Fitted titles are converted to the montage mode to be pasted as is
+            render = lambda: ensure_size(self.title(), size, keep_proportions=True).convert(self.template.mode)
+        return self._cached(self._titles, (*title_key, size, self.template.mode), render, maxsize=16)
+
+    def background(self, capture_size: Tuple[int, int]):
+        # Montages for a given capture size only differ by their captures
+        layout = self.template.layout(capture_size)
+        return self._cached(
+            self._backgrounds,
+            (self.template, layout, self._title_key()),
+            lambda: self.template.background(layout, self.title(self.template.title_size(capture_size))),
+            maxsize=2,
+        )
+
+    def _pre_process_title(self, image_path: Path):
+        with Image.open(image_path) as title:
             title.load()
         return apply_filters(title, self.title_filters)
+
+
+# Pre-process each capture in the background while the next one is being shot,
+# only the montage is left to assemble once the last capture is saved.
+class ProcessingSession:
+    def __init__(self, processor: CaptureProcessor) -> None:
+        self.processor = processor
+        self.futures: List[Future] = []
+
+    def submit(self, capture: Union[Path, Capture]):
+        self.futures.append(
+            self.processor.engine.submit(capture)
+        )
+
+    def cancel(self):
+        for future in self.futures:
+            future.cancel()
+
+    def process(self, output_file_path: Path):
+        with tracing.span("wait"):
+            images = [future.result() for future in self.futures]
+        self.processor._assemble(images, output_file_path)
@@ -0,0 +1,78 @@
+from functools import lru_cache
+import inspect
+import json
+from typing import Dict, List
+
+import numpy
+
+from app import image_filters, templates
+from app.config import FilterConfig, PresetConfig, ProcessingConfig, TemplateConfig
+from app.image_filters import ImageFilter
+from app.image_helpers import FilterPipeline
+from app.templates import MontageTemplate
+
+
+# Filters and templates are built once per configuration and shared by every processor,
+# so switching back and forth between presets keeps their lookup tables and layouts.
+
+def _instantiate(module, base: type, name: str, params: Dict):
+    cls = getattr(module, name, None)
+    if not isinstance(cls, type) or not issubclass(cls, base) or cls is base:
+        raise ValueError("Unknown %s %r" % (base.__name__, name))
+    try:
+        inspect.signature(cls).bind(**params)
+    except TypeError as e:
+        raise ValueError("Invalid parameters for %s: %s" % (name, e)) from e
+    return cls(**params)
+
+
+def _filters_key(filters: List[FilterConfig]) -> str:
+    return json.dumps([filter.model_dump(mode="json") for filter in filters], sort_keys=True)
+
+
+@lru_cache(maxsize=32)
+def _filter_pipeline(key: str) -> FilterPipeline:
+    filters = []
+    for config in json.loads(key):
+        filter = _instantiate(image_filters, ImageFilter, config["name"], config["params"])
+        # Run once on a tiny image so invalid parameter values fail now, not on a guest
+        try:
+            filter.process_array(numpy.zeros((2, 2, 3), numpy.uint8))
+        except Exception as e:
+            raise ValueError("Invalid parameters for %s: %r" % (config["name"], e)) from e
+        filters.append(filter)
+    return FilterPipeline(filters)
+
+
+def filter_pipeline(filters: List[FilterConfig]) -> FilterPipeline:
+    return _filter_pipeline(_filters_key(filters))
+
+
+@lru_cache(maxsize=16)
+def _template(key: str) -> MontageTemplate:
+    config = json.loads(key)
+    template = _instantiate(templates, MontageTemplate, config["name"], config["params"])
+    try:
+        template.layout(template.capture_size(300))
+    except Exception as e:
+        raise ValueError("Invalid parameters for %s: %r" % (config["name"], e)) from e
+    return template
+
+
+def template(config: TemplateConfig) -> MontageTemplate:
+    return _template(json.dumps(config.model_dump(mode="json"), sort_keys=True))
+
+
+def resolve(settings: ProcessingConfig, presets: Dict[str, PresetConfig]) -> PresetConfig:
+    # Template and filters set in the processing settings override the ones of the preset
+    preset = presets.get(settings.preset) if settings.preset is not None else None
+    if settings.preset is not None and preset is None:
+        raise ValueError("Unknown preset %r" % settings.preset)
+    template = settings.template or (preset.template if preset else None)
+    if template is None:
+        raise ValueError("Could not find template from provided configuration")
+    return PresetConfig(
+        template=template,
+        filters=settings.filters or (preset.filters if preset else []),
+        title_filters=settings.title.filters or (preset.title_filters if preset else []),
+    )
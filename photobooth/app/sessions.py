@@ -0,0 +1,123 @@
+import hashlib
+import logging
+import os
+from pathlib import Path
+import sqlite3
+import threading
+import time
+from typing import Dict, List, Optional, Sequence, Union
+
+from app.entities import Capture
+
+
+CAPTURED = "captured"
+PROCESSED = "processed"
+DONE = "done"
+# Captures lost or processing failed, the session is not resumed
+FAILED = "failed"
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS sessions (
+    id TEXT PRIMARY KEY,
+    preset TEXT,
+    state TEXT NOT NULL,
+    output TEXT,
+    created_at REAL NOT NULL,
+    updated_at REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS sessions_state ON sessions (state);
+CREATE TABLE IF NOT EXISTS captures (
+    session_id TEXT NOT NULL REFERENCES sessions (id) ON DELETE CASCADE,
+    position INTEGER NOT NULL,
+    path TEXT NOT NULL,
+    PRIMARY KEY (session_id, position)
+);
+"""
+
+
+def content_hash(data: bytes) -> str:
+    return hashlib.sha256(data).hexdigest()[:16]
+
+
+def session_id(captures: List[Union[Path, Capture]]) -> str:
+    # Downloaded captures are already named after their content, files given by path
+    # (simulation, reprocessing) are hashed here. The same captures always give the same
+    # session, so a session processed again after a crash overwrites its own output.
+    digest = hashlib.sha256()
+    for capture in captures:
+        if isinstance(capture, Capture):
+            digest.update(capture.path.stem.encode())
+        else:
+            with open(capture, "rb") as fh:
+                digest.update(content_hash(fh.read()).encode())
+    return digest.hexdigest()[:16]
+
+
+# Sessions and their captures are recorded in SQLite as they go from captured to processed
+# to done, the ones left behind by a crash are picked up again at start-up.
+class SessionStore:
+    def __init__(self, path: Path) -> None:
+        os.makedirs(Path(path).parent, exist_ok=True)
+        self.lock = threading.Lock()
+        self.connection = sqlite3.connect(str(path), check_same_thread=False, isolation_level=None)
+        # WAL keeps each state change to one small append, safe to lose power after
+        self.connection.execute("PRAGMA journal_mode=WAL")
+        self.connection.execute("PRAGMA synchronous=NORMAL")
+        self.connection.execute("PRAGMA foreign_keys=ON")
+        self.connection.executescript(SCHEMA)
+
+    def record(self, session: str, captures: List[Path], preset: Optional[str]):
+        now = time.time()
+        with self.lock, self.connection:
+            self.connection.execute("BEGIN")
+            self.connection.execute("DELETE FROM sessions WHERE id = ?", (session,))
+            self.connection.execute(
+                "INSERT INTO sessions (id, preset, state, created_at, updated_at) VALUES (?, ?, ?, ?, ?)",
+                (session, preset, CAPTURED, now, now),
+            )
+            self.connection.executemany(
+                "INSERT INTO captures (session_id, position, path) VALUES (?, ?, ?)",
+                [(session, position, str(path)) for position, path in enumerate(captures)],
+            )
+
+    def update(self, session: str, state: str, output: Optional[Path] = None):
+        with self.lock:
+            self.connection.execute(
+                "UPDATE sessions SET state = ?, output = COALESCE(?, output), updated_at = ? WHERE id = ?",
+                (state, str(output) if output is not None else None, time.time(), session),
+            )
+
+    def unfinished(self) -> List[Dict]:
+        return self.sessions(states=(CAPTURED, PROCESSED))
+
+    def sessions(self, states: Sequence[str] = (CAPTURED, PROCESSED, DONE)) -> List[Dict]:
+        with self.lock:
+            rows = self.connection.execute(
+                "SELECT id, preset, state, output FROM sessions WHERE state IN (%s) ORDER BY created_at"
+                % ", ".join("?" * len(states)),
+                tuple(states),
+            ).fetchall()
+            sessions = []
+            for id, preset, state, output in rows:
+                captures = self.connection.execute(
+                    "SELECT path FROM captures WHERE session_id = ? ORDER BY position", (id,),
+                ).fetchall()
+                sessions.append(dict(
+                    id=id,
+                    preset=preset,
+                    state=state,
+                    output=Path(output) if output else None,
+                    captures=[Path(path) for path, in captures],
+                ))
+            return sessions
+
+
+def clean_up(directory: Path, before: float, pattern: str = "*"):
+    # Half written files left by a crash, newer ones may still be written to
+    for path in Path(directory).glob(pattern):
+        try:
+            if path.is_file() and path.stat().st_mtime < before:
+                path.unlink()
+                logging.info("Removed leftover %s", path)
+        except OSError as e:
+            logging.error(e)
@@ -1,5 +1,6 @@
 import abc
 from dataclasses import dataclass
+from functools import lru_cache
 from typing import Any, ClassVar, Optional, Tuple
 
 from PIL import Image, ImageDraw
@@ -19,17 +20,101 @@ def _absolute_margin_from_size(margin: str, size: Tuple[int, int]) -> int:
         raise NotImplementedError()
 
 
+def _relative_margin(margin: str) -> float:
+    if margin.endswith("%"):
+        return int(margin[0:-1]) / 100
+    else:
+        raise NotImplementedError()
+
+
+def _pixels_from_centimeters(length: float, dpi: int) -> int:
+    return int(length * dpi / 2.54)
+
+
+Box = Tuple[int, int, int, int]
+Line = Tuple[Tuple[int, int], Tuple[int, int]]
+
+
+@dataclass(frozen=True)
+class MontageLayout:
+    size: Tuple[int, int]
+    # Paste offset of each capture cell, with the index of the capture it shows
+    cells: Tuple[Tuple[int, Tuple[int, int]], ...]
+    title_boxes: Tuple[Box, ...] = ()
+    cut_lines: Tuple[Line, ...] = ()
+
+
 class MontageTemplate(abc.ABC):
     capture_count: ClassVar[int]
     format: ClassVar[PictureFormat]
     capture_format: ClassVar[PictureFormat]
     orientation: ClassVar[PictureOrientation]
+    mode: ClassVar[str] = "RGB"
+
+    background_color: str = "white"
+
+    def capture_size(self, dpi: int) -> Tuple[int, int]:
+        raise NotImplementedError()
 
-    def process(self, images, title_image: Optional[Any] = None):
+    def layout(self, capture_size: Tuple[int, int]) -> MontageLayout:
         raise NotImplementedError()
 
+    def title_size(self, capture_size: Tuple[int, int]) -> Optional[Tuple[int, int]]:
+        title_boxes = self.layout(capture_size).title_boxes
+        if not title_boxes:
+            return None
+        left, top, right, bottom = title_boxes[0]
+        return (right - left, bottom - top)
+
+    def background(self, layout: MontageLayout, title_image: Optional[Any] = None):
+        # Everything but the captures, to be copied for each montage
+        return self.render(layout, title_image=title_image)
+
+    def render(
+        self,
+        layout: MontageLayout,
+        images=(),
+        title_image: Optional[Any] = None,
+        top: int = 0,
+        bottom: Optional[int] = None,
+    ):
+        # Render the horizontal band of the montage between top and bottom
+        width, height = layout.size
+        bottom = height if bottom is None else bottom
+        band = Image.new(self.mode, size=(width, bottom - top), color=self.background_color)
+
+        if title_image is not None:
+            for left, box_top, right, box_bottom in layout.title_boxes:
+                title = ensure_size(title_image, (right - left, box_bottom - box_top), keep_proportions=True)
+                title_top = box_top + int((box_bottom - box_top - title.height) / 2)
+                if title_top < bottom and title_top + title.height > top:
+                    band.paste(title, (left, title_top - top))
+
+        if images:
+            for index, (left, cell_top) in layout.cells:
+                if cell_top < bottom and cell_top + images[index].height > top:
+                    band.paste(images[index], (left, cell_top - top))
+
+        if layout.cut_lines:
+            draw = ImageDraw.Draw(band)
+            for (x0, y0), (x1, y1) in layout.cut_lines:
+                draw.line([(x0, y0 - top), (x1, y1 - top)], fill="white", width=2)
 
-@dataclass
+        return band
+
+    def process(self, images, title_image: Optional[Any] = None, background: Optional[Any] = None):
+        assert len(images) == self.capture_count
+        layout = self.layout(min_common_size(images))
+        if background is None:
+            background = self.background(layout, title_image)
+
+        montage = background.copy()
+        for index, offset in layout.cells:
+            montage.paste(images[index], offset)
+        return montage
+
+
+@dataclass(frozen=True)
 class StripWithTitle(MontageTemplate):
     capture_count: ClassVar[int] = 3
     format: ClassVar[PictureFormat] = PictureFormat.FORMAT_LANDSCAPE_15x5
@@ -44,40 +129,34 @@ class StripWithTitle(MontageTemplate):
         montage_width = int(montage_height * self.format.value[0] / self.format.value[1])
         return (montage_width, montage_height)
 
-    def process(self, images, title_image: Optional[Any] = None):
-        assert len(images) == self.capture_count
-        common_image_size = min_common_size(images)
-        margins_px = _absolute_margin_from_size(self.margin, common_image_size)
-        montage_size = self._montage_size(common_image_size, margins_px)
-
-        montage = Image.new('RGB', size=montage_size, color=self.background_color)
-
-        offset = (margins_px, margins_px)
-        for image in images:
-            montage.paste(image, offset)
-            offset = (
-                offset[0] + image.size[0] + margins_px,
-                offset[1],
-            )
-
-        if title_image is not None:
-            title_size = (
-                montage_size[0] - offset[0] - margins_px,
-                montage_size[1] - offset[1] - margins_px,
-            )
-            title_image = ensure_size(title_image, title_size, keep_proportions=True)
-            montage.paste(
-                title_image,
-                (
-                    offset[0],
-                    int((montage_size[1] - title_image.height) / 2)
-                ),
-            )
-
-        return montage
-
-
-@dataclass
+    def capture_size(self, dpi: int) -> Tuple[int, int]:
+        # Invert _montage_size: the margin is relative to the largest capture side
+        montage_height = _pixels_from_centimeters(self.format.value[1], dpi)
+        capture_ratio = self.capture_format.value[0] / self.capture_format.value[1]
+        margin = _relative_margin(self.margin)
+        capture_height = int(montage_height / (1 + 2 * margin * max(1, capture_ratio)))
+        return (int(capture_height * capture_ratio), capture_height)
+
+    @lru_cache(maxsize=8)
+    def layout(self, capture_size: Tuple[int, int]) -> MontageLayout:
+        margins_px = _absolute_margin_from_size(self.margin, capture_size)
+        montage_size = self._montage_size(capture_size, margins_px)
+
+        cells = tuple(
+            (index, (margins_px + index * (capture_size[0] + margins_px), margins_px))
+            for index in range(self.capture_count)
+        )
+        title_left = margins_px + self.capture_count * (capture_size[0] + margins_px)
+        title_box = (
+            title_left,
+            margins_px,
+            montage_size[0] - margins_px,
+            montage_size[1] - margins_px,
+        )
+        return MontageLayout(size=montage_size, cells=cells, title_boxes=(title_box,))
+
+
+@dataclass(frozen=True)
 class DoubleStripWithTitle(MontageTemplate):
     capture_count: ClassVar[int] = 3
     format: ClassVar[PictureFormat] = PictureFormat.FORMAT_LANDSCAPE_15x10
@@ -88,19 +167,33 @@ class DoubleStripWithTitle(MontageTemplate):
     margin: str = "2%"
     line: bool = False
 
-    def process(self, images, title_image: Optional[Any] = None):
-        single_strip = StripWithTitle(
+    @property
+    def strip(self) -> StripWithTitle:
+        return StripWithTitle(
             background_color=self.background_color,
             margin=self.margin,
-        ).process(images, title_image)
-        montage_size = (single_strip.size[0], single_strip.size[1] * 2)
-        montage = Image.new('RGB', size=montage_size, color=self.background_color)
-        montage.paste(single_strip, (0, 0))
-        montage.paste(single_strip, (0, single_strip.size[1]))
-
-        # Draw a cutting line
-        if self.line:
-            draw = ImageDraw.Draw(montage)
-            draw.line([(0, montage_size[1]/2), (montage_size[0], montage_size[1]/2)], fill="white", width=2)
-
-        return montage
+        )
+
+    def capture_size(self, dpi: int) -> Tuple[int, int]:
+        return self.strip.capture_size(dpi)
+
+    @lru_cache(maxsize=8)
+    def layout(self, capture_size: Tuple[int, int]) -> MontageLayout:
+        # Two strips on top of each other, each capture is pasted in both halves
+        strip = self.strip.layout(capture_size)
+        width, height = strip.size
+        cells = strip.cells + tuple(
+            (index, (left, top + height))
+            for index, (left, top) in strip.cells
+        )
+        title_boxes = strip.title_boxes + tuple(
+            (left, top + height, right, bottom + height)
+            for left, top, right, bottom in strip.title_boxes
+        )
+        cut_lines = (((0, height), (width, height)),) if self.line else ()
+        return MontageLayout(
+            size=(width, height * 2),
+            cells=cells,
+            title_boxes=title_boxes,
+            cut_lines=cut_lines,
+        )
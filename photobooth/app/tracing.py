@@ -0,0 +1,118 @@
+from contextlib import contextmanager
+from contextvars import ContextVar
+import json
+import os
+from pathlib import Path
+import threading
+import time
+import tracemalloc
+from typing import Any, Dict, Iterator, List, Optional
+
+
+# The trace of the session being handled, spans recorded outside of a session are dropped
+_current: ContextVar[Optional["Trace"]] = ContextVar("trace", default=None)
+
+
+class Trace:
+    def __init__(self, start: Optional[float] = None, **attributes) -> None:
+        # A session starts when the button is pressed, before it waits for its turn
+        self.attributes: Dict[str, Any] = attributes
+        self.start = time.monotonic() if start is None else start
+        self.started_at = time.time() - (time.monotonic() - self.start)
+        self.spans: List[Dict[str, Any]] = []
+        self.lock = threading.Lock()
+
+    def add(self, name: str, start: float, end: float, **attributes):
+        with self.lock:
+            self.spans.append(dict(name=name, start=start, end=end, **attributes))
+
+    def extend(self, spans: List[Dict[str, Any]]):
+        with self.lock:
+            self.spans.extend(spans)
+
+    @contextmanager
+    def activate(self) -> Iterator["Trace"]:
+        token = _current.set(self)
+        try:
+            yield self
+        finally:
+            _current.reset(token)
+
+    def to_dict(self) -> Dict[str, Any]:
+        # Monotonic timestamps are only meaningful relative to the start of the session
+        with self.lock:
+            spans = sorted(self.spans, key=lambda span: span["start"])
+        return dict(
+            self.attributes,
+            started_at=self.started_at,
+            duration=round(time.monotonic() - self.start, 6),
+            spans=[
+                dict(
+                    {key: value for key, value in span.items() if key != "end"},
+                    start=round(span["start"] - self.start, 6),
+                    duration=round(span["end"] - span["start"], 6),
+                )
+                for span in spans
+            ],
+        )
+
+    def write(self, path: Path):
+        record = self.to_dict()
+        os.makedirs(Path(path).parent, exist_ok=True)
+        with open(path, "a") as fh:
+            fh.write(json.dumps(record) + "\n")
+
+
+def stage_totals(record: Dict[str, Any]) -> Dict[str, float]:
+    # Spans sharing a name within a session, one per capture for instance, are summed
+    totals: Dict[str, float] = {}
+    for span in record["spans"]:
+        totals[span["name"]] = round(totals.get(span["name"], 0) + span["duration"], 6)
+    totals["session"] = record["duration"]
+    return totals
+
+
+def current() -> Optional[Trace]:
+    return _current.get()
+
+
+def _traced_memory() -> Optional[int]:
+    # Only when tracemalloc was started, by the benchmark for instance. The peak is shared
+    # by every thread, so allocations only add up when stages run one after another.
+    if not tracemalloc.is_tracing():
+        return None
+    current, _ = tracemalloc.get_traced_memory()
+    tracemalloc.reset_peak()
+    return current
+
+
+@contextmanager
+def span(name: str, **attributes) -> Iterator[None]:
+    trace = _current.get()
+    if trace is None:
+        yield
+        return
+    start = time.monotonic()
+    cpu = time.thread_time()
+    memory = _traced_memory()
+    try:
+        yield
+    finally:
+        end = time.monotonic()
+        attributes["cpu"] = round(time.thread_time() - cpu, 6)
+        if memory is not None:
+            attributes["allocated"] = tracemalloc.get_traced_memory()[1] - memory
+        trace.add(name, start, end, **attributes)
+
+
+def record(name: str, start: float, **attributes):
+    trace = _current.get()
+    if trace is not None:
+        trace.add(name, start, time.monotonic(), **attributes)
+
+
+@contextmanager
+def collect() -> Iterator[Trace]:
+    # Spans recorded in a worker process are gathered and sent back with the result
+    with Trace().activate() as trace:
+        yield trace
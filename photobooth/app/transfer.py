@@ -0,0 +1,232 @@
+import asyncio
+from collections import deque
+import hashlib
+import hmac
+import ipaddress
+import json
+import logging
+import os
+from pathlib import Path
+import threading
+from typing import Callable, Deque, Optional, Set
+
+
+# Montages are pushed from the booth to the print side over a single TCP connection.
+# Each file is sent as a JSON header line followed by its bytes, and the receiver
+# acknowledges it once it is safely written. Acknowledged files are appended to a
+# ledger on the booth side so a reconnection only resends what was not received.
+# With a token, the receiver first sends it on a line of its own and the booth drops
+# connections that do not.
+
+ACK_TIMEOUT = 60
+
+
+def _read_ledger(ledger: Path) -> Set[str]:
+    if not ledger.is_file():
+        return set()
+    with open(ledger) as fh:
+        return {line.strip() for line in fh if line.strip()}
+
+
+def _is_loopback(host: str) -> bool:
+    try:
+        return ipaddress.ip_address(host).is_loopback
+    except ValueError:
+        return host == "localhost"
+
+
+class TransferServer:
+    def __init__(self, directory: Path, ledger: Path, host: str, port: int, token: Optional[str] = None) -> None:
+        self.directory = Path(directory)
+        self.ledger = Path(ledger)
+        self.host = host
+        self.port = port
+        self.token = token
+
+        self.lock = threading.Lock()
+        self.pending: Deque[Path] = deque()
+        # Names acknowledged by the receiver, and names waiting or being sent
+        self.sent: Set[str] = set()
+        self.queued: Set[str] = set()
+        self.loop: Optional[asyncio.AbstractEventLoop] = None
+        self.wakeup: Optional[asyncio.Event] = None
+        self.connection_lock: Optional[asyncio.Lock] = None
+
+    def start(self):
+        os.makedirs(self.directory, exist_ok=True)
+        os.makedirs(self.ledger.parent, exist_ok=True)
+
+        # Files finished while the service was down are sent first
+        sent = _read_ledger(self.ledger)
+        with self.lock:
+            self.sent = sent
+            for path in sorted(self.directory.iterdir()):
+                if path.is_file():
+                    self._queue(path)
+        ready = threading.Event()
+        threading.Thread(target=self._run, args=(ready,), name="transfer-server", daemon=True).start()
+        ready.wait()
+
+    def _run(self, ready: threading.Event):
+        asyncio.run(self._serve(ready))
+
+    async def _serve(self, ready: threading.Event):
+        self.loop = asyncio.get_running_loop()
+        self.wakeup = asyncio.Event()
+        self.connection_lock = asyncio.Lock()
+        server = await asyncio.start_server(self._handle, self.host, self.port)
+        logging.info("Transfer service listening on %s:%s", self.host, self.port)
+        if self.token is None and not _is_loopback(self.host):
+            logging.warning("Transfer service reachable from the network without a token")
+        ready.set()
+        async with server:
+            await server.serve_forever()
+
+    def _queue(self, path: Path) -> bool:
+        # A resumed session publishes its montage again, it is only sent once
+        if path.name in self.sent or path.name in self.queued:
+            return False
+        self.queued.add(path.name)
+        self.pending.append(path)
+        return True
+
+    def publish(self, path: Path):
+        with self.lock:
+            if not self._queue(Path(path)):
+                return
+        if self.loop is not None:
+            self.loop.call_soon_threadsafe(self.wakeup.set)
+
+    def _next(self) -> Optional[Path]:
+        with self.lock:
+            return self.pending.popleft() if self.pending else None
+
+    def _retry(self, path: Path):
+        with self.lock:
+            self.pending.appendleft(path)
+
+    async def _handle(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        peer = writer.get_extra_info("peername")
+        if self.token is not None and not await self._authenticate(reader):
+            logging.warning("Receiver %s rejected, wrong token", peer)
+            writer.close()
+            return
+        async with self.connection_lock:
+            logging.info("Receiver connected from %s", peer)
+            try:
+                while True:
+                    path = self._next()
+                    if path is None:
+                        self.wakeup.clear()
+                        await self._idle(reader)
+                        continue
+                    try:
+                        await self._send(path, reader, writer)
+                    except FileNotFoundError:
+                        logging.warning("%s disappeared before being sent", path)
+                        with self.lock:
+                            self.queued.discard(path.name)
+                    except BaseException:
+                        self._retry(path)
+                        raise
+            except (ConnectionError, asyncio.IncompleteReadError, asyncio.TimeoutError) as e:
+                logging.warning("Receiver %s disconnected: %s", peer, e)
+            finally:
+                writer.close()
+
+    async def _authenticate(self, reader: asyncio.StreamReader) -> bool:
+        try:
+            line = await asyncio.wait_for(reader.readline(), ACK_TIMEOUT)
+            token = json.loads(line).get("token")
+        except (ConnectionError, asyncio.TimeoutError, ValueError, AttributeError):
+            return False
+        return isinstance(token, str) and hmac.compare_digest(token.encode(), self.token.encode())
+
+    async def _idle(self, reader: asyncio.StreamReader):
+        # The receiver only talks to acknowledge files, reading while idle notices it leaving
+        # right away instead of holding the connection until the next file is published
+        wakeup = asyncio.ensure_future(self.wakeup.wait())
+        closed = asyncio.ensure_future(reader.read(1))
+        try:
+            await asyncio.wait((wakeup, closed), return_when=asyncio.FIRST_COMPLETED)
+        finally:
+            wakeup.cancel()
+            closed.cancel()
+        if closed.done() and not closed.cancelled():
+            raise ConnectionError("receiver closed the connection")
+
+    async def _send(self, path: Path, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        data = await asyncio.to_thread(path.read_bytes)
+        header = {
+            "name": path.name,
+            "size": len(data),
+            "sha256": hashlib.sha256(data).hexdigest(),
+        }
+        writer.write(json.dumps(header).encode() + b"\n")
+        writer.write(data)
+        await writer.drain()
+
+        line = await asyncio.wait_for(reader.readline(), ACK_TIMEOUT)
+        if not line:
+            raise ConnectionError("connection closed before acknowledgement")
+        if json.loads(line).get("ack") != path.name:
+            raise ConnectionError("unexpected acknowledgement %r" % line)
+
+        with open(self.ledger, "a") as fh:
+            fh.write(path.name + "\n")
+        with self.lock:
+            self.sent.add(path.name)
+            self.queued.discard(path.name)
+        logging.info("Transferred %s", path.name)
+
+
+async def receive(
+    host: str,
+    port: int,
+    directory: Path,
+    on_file: Callable[[Path], None],
+    token: Optional[str] = None,
+    retry_delay: float = 1,
+    max_retry_delay: float = 30,
+):
+    directory = Path(directory)
+    os.makedirs(directory, exist_ok=True)
+    delay = retry_delay
+    while True:
+        try:
+            reader, writer = await asyncio.open_connection(host, port)
+        except OSError as e:
+            logging.warning("Could not connect to %s:%s (%s), retrying in %ss", host, port, e, delay)
+            await asyncio.sleep(delay)
+            delay = min(delay * 2, max_retry_delay)
+            continue
+
+        logging.info("Connected to %s:%s", host, port)
+        delay = retry_delay
+        try:
+            if token is not None:
+                writer.write(json.dumps({"token": token}).encode() + b"\n")
+                await writer.drain()
+            while True:
+                line = await reader.readline()
+                if not line:
+                    break
+                header = json.loads(line)
+                data = await reader.readexactly(header["size"])
+                if hashlib.sha256(data).hexdigest() != header["sha256"]:
+                    raise ConnectionError("checksum mismatch for %s" % header["name"])
+
+                # Written next to the target and renamed, so only complete files show up
+                path = directory / Path(header["name"]).name
+                tmp_path = directory / (".%s.part" % path.name)
+                await asyncio.to_thread(tmp_path.write_bytes, data)
+                os.replace(tmp_path, path)
+
+                writer.write(json.dumps({"ack": header["name"]}).encode() + b"\n")
+                await writer.drain()
+                on_file(path)
+        except (ConnectionError, asyncio.IncompleteReadError, ValueError) as e:
+            logging.warning("Transfer interrupted: %s", e)
+        finally:
+            writer.close()
+        await asyncio.sleep(delay)
@@ -0,0 +1,149 @@
+import ctypes
+import ctypes.util
+import errno
+import logging
+import os
+from pathlib import Path
+import select
+import struct
+import time
+from typing import Dict, Iterator, Optional, Sequence, Set, Tuple
+
+
+IN_CLOSE_WRITE = 0x00000008
+IN_MOVED_FROM = 0x00000040
+IN_MOVED_TO = 0x00000080
+IN_DELETE = 0x00000200
+IN_DELETE_SELF = 0x00000400
+IN_MOVE_SELF = 0x00000800
+IN_Q_OVERFLOW = 0x00004000
+IN_IGNORED = 0x00008000
+IN_ISDIR = 0x40000000
+IN_NONBLOCK = 0x00000800
+IN_CLOEXEC = 0x00080000
+
+EVENT_HEADER = struct.Struct("iIII")
+
+
+def _inotify():
+    if not hasattr(os, "uname") or os.uname().sysname != "Linux":
+        return None
+    try:
+        libc = ctypes.CDLL(ctypes.util.find_library("c") or "libc.so.6", use_errno=True)
+        libc.inotify_init1
+    except (OSError, AttributeError):
+        return None
+    return libc
+
+
+# Yields each file of a directory once, as soon as it has been completely written: files
+# present when watching starts, then files closed after writing or renamed into it.
+class DirectoryWatcher:
+    def __init__(
+        self,
+        directory: Path,
+        suffixes: Optional[Sequence[str]] = None,
+        poll_interval: float = 1,
+        use_inotify: bool = True,
+    ) -> None:
+        self.directory = Path(directory)
+        self.suffixes = tuple(suffix.lower() for suffix in suffixes) if suffixes else None
+        self.poll_interval = poll_interval
+        self.libc = _inotify() if use_inotify else None
+        self.seen: Set[str] = set()
+
+    def _accepts(self, name: str) -> bool:
+        # Hidden files are partial transfers or editor leftovers
+        if name.startswith("."):
+            return False
+        return self.suffixes is None or name.lower().endswith(self.suffixes)
+
+    def _emit(self, name: str) -> Optional[Path]:
+        if name in self.seen or not self._accepts(name):
+            return None
+        path = self.directory / name
+        if not path.is_file():
+            return None
+        self.seen.add(name)
+        return path
+
+    def _scan(self) -> Iterator[Path]:
+        for name in sorted(entry.name for entry in os.scandir(self.directory) if entry.is_file()):
+            path = self._emit(name)
+            if path is not None:
+                yield path
+
+    def existing(self) -> Iterator[Path]:
+        # A single pass over the files already there, without watching for new ones
+        os.makedirs(self.directory, exist_ok=True)
+        return self._scan()
+
+    def __iter__(self) -> Iterator[Path]:
+        os.makedirs(self.directory, exist_ok=True)
+        if self.libc is not None:
+            fd = self.libc.inotify_init1(IN_NONBLOCK | IN_CLOEXEC)
+            if fd >= 0:
+                return self._watch_inotify(fd)
+            logging.warning("inotify is unavailable (%s), polling %s", os.strerror(ctypes.get_errno()), self.directory)
+        return self._watch_polling()
+
+    def _watch_inotify(self, fd: int) -> Iterator[Path]:
+        mask = IN_CLOSE_WRITE | IN_MOVED_TO | IN_MOVED_FROM | IN_DELETE | IN_DELETE_SELF | IN_MOVE_SELF
+        try:
+            if self.libc.inotify_add_watch(fd, bytes(self.directory), mask) < 0:
+                raise OSError(ctypes.get_errno(), "inotify_add_watch", str(self.directory))
+
+            # The watch is in place before the scan, so no file can fall in between
+            yield from self._scan()
+
+            while True:
+                select.select([fd], [], [])
+                try:
+                    buffer = os.read(fd, 64 * 1024)
+                except BlockingIOError:
+                    continue
+                for event_mask, name in self._events(buffer):
+                    if event_mask & (IN_DELETE_SELF | IN_MOVE_SELF | IN_IGNORED):
+                        raise OSError(errno.ENOENT, "Watched directory is gone", str(self.directory))
+                    if event_mask & IN_ISDIR:
+                        continue
+                    if event_mask & IN_Q_OVERFLOW:
+                        logging.warning("Missed some events on %s, rescanning", self.directory)
+                        yield from self._scan()
+                    elif event_mask & (IN_MOVED_FROM | IN_DELETE):
+                        self.seen.discard(name)
+                    elif event_mask & (IN_CLOSE_WRITE | IN_MOVED_TO):
+                        path = self._emit(name)
+                        if path is not None:
+                            yield path
+        finally:
+            os.close(fd)
+
+    @staticmethod
+    def _events(buffer: bytes) -> Iterator[Tuple[int, str]]:
+        position = 0
+        while position < len(buffer):
+            _, mask, _, length = EVENT_HEADER.unpack_from(buffer, position)
+            position += EVENT_HEADER.size
+            name = buffer[position:position + length].rstrip(b"\0")
+            position += length
+            yield mask, os.fsdecode(name)
+
+    def _watch_polling(self) -> Iterator[Path]:
+        # A file is complete once its size and modification time held still for a poll
+        candidates: Dict[str, Tuple[int, int]] = {}
+        while True:
+            stats = {}
+            for entry in os.scandir(self.directory):
+                if entry.is_file() and self._accepts(entry.name):
+                    stat = entry.stat()
+                    stats[entry.name] = (stat.st_size, stat.st_mtime_ns)
+
+            self.seen.intersection_update(stats)
+            for name in sorted(stats.keys() - self.seen):
+                if candidates.get(name) == stats[name]:
+                    path = self._emit(name)
+                    if path is not None:
+                        yield path
+            candidates = stats
+            time.sleep(self.poll_interval)
@@ -0,0 +1,408 @@
+import argparse
+from collections import defaultdict
+from concurrent.futures import ProcessPoolExecutor
+import dataclasses
+import json
+from pathlib import Path
+import resource
+import sys
+import tempfile
+import time
+import tracemalloc
+from typing import Dict, List, Tuple
+
+import numpy
+from PIL import Image
+import yaml
+
+from app import image_filters, templates, tracing
+from app.config import EncoderConfig, FilterConfig, PresetConfig, ProcessingConfig, TemplateConfig
+from app.image_helpers import ensure_size
+from app.output import save_banded, save_image
+from app.process import CaptureProcessor, ensure_format, load_image
+from app.tracing import Trace
+
+
+RESOLUTIONS = {
+    12: (4240, 2832),
+    24: (6000, 4000),
+    45: (8256, 5504),
+}
+
+
+FILTERS = [
+    image_filters.BlackAndWhite(),
+    image_filters.Inverted(),
+    image_filters.LevelImage(),
+    image_filters.ColorLevel(red=(0, 190), green=(30, 220), blue=(30, 220)),
+    image_filters.AutoColorLevel(),
+    image_filters.MirrorImage(),
+]
+
+
+def synthetic_array(size: Tuple[int, int], seed: int = 0):
+    # Smooth gradients with some noise, so the JPEG looks like a photo to the encoder
+    width, height = size
+    rng = numpy.random.default_rng(seed)
+    x = numpy.linspace(0, 1, width, dtype=numpy.float32)
+    y = numpy.linspace(0, 1, height, dtype=numpy.float32)[:, None]
+    channels = [
+        numpy.sin((x * (3 + i) + y * (2 + i)) * numpy.pi) * 100 + 128
+        for i in range(3)
+    ]
+    image = numpy.dstack(channels) + rng.normal(0, 12, (height, width, 1)).astype(numpy.float32)
+    return numpy.clip(image, 0, 255).astype(numpy.uint8)
+
+
+def synthetic_capture(path: Path, megapixels: int, seed: int = 0) -> Path:
+    Image.fromarray(synthetic_array(RESOLUTIONS[megapixels], seed)).save(path, quality=92)
+    return path
+
+
+def peak_rss_mb() -> float:
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    if sys.platform == "darwin":
+        return peak / 1024 / 1024
+    return peak / 1024
+
+
+def current_rss_mb() -> float:
+    statm = Path("/proc/self/statm")
+    if not statm.exists():
+        return 0
+    return int(statm.read_text().split()[1]) * resource.getpagesize() / 1024 / 1024
+
+
+def isolated(function, *args):
+    # Run in a fresh process so peak RSS is not polluted by previous runs
+    with ProcessPoolExecutor(max_workers=1) as executor:
+        return executor.submit(function, *args).result()
+
+
+def psnr(first, second) -> float:
+    first = numpy.asarray(first, numpy.float32)
+    second = numpy.asarray(second, numpy.float32)
+    mse = numpy.mean((first - second) ** 2)
+    if mse == 0:
+        return float("inf")
+    return 10 * numpy.log10(255 ** 2 / mse)
+
+
+def _decode_to_capture_size(path: Path, template, capture_size, draft: bool):
+    start = time.perf_counter()
+    image = load_image(path, draft_size=capture_size if draft else None)
+    decoded_size = image.size
+    image = ensure_format(image, template.capture_format)
+    image = ensure_size(image, capture_size)
+    elapsed = time.perf_counter() - start
+    return elapsed, peak_rss_mb(), decoded_size, image.tobytes()
+
+
+def benchmark_draft(args):
+    template = getattr(templates, args.template)()
+    capture_size = template.capture_size(args.dpi)
+    print("Capture size in %s at %s dpi: %sx%s" % (args.template, args.dpi, *capture_size))
+
+    with tempfile.TemporaryDirectory() as directory:
+        captures = args.captures or [
+            synthetic_capture(Path(directory) / ("%smp.jpg" % megapixels), megapixels)
+            for megapixels in args.megapixels
+        ]
+        for capture in captures:
+            full_time, full_rss, full_size, full = isolated(
+                _decode_to_capture_size, capture, template, capture_size, False,
+            )
+            draft_time, draft_rss, draft_size, reduced = isolated(
+                _decode_to_capture_size, capture, template, capture_size, True,
+            )
+            full = Image.frombytes("RGB", capture_size, full)
+            reduced = Image.frombytes("RGB", capture_size, reduced)
+            print(Path(capture).name)
+            print("  full:  decoded %5sx%-5s %6.3fs  peak RSS %7.1f MB" % (*full_size, full_time, full_rss))
+            print("  draft: decoded %5sx%-5s %6.3fs  peak RSS %7.1f MB" % (*draft_size, draft_time, draft_rss))
+            print("  speedup x%.1f, PSNR %.1f dB" % (full_time / draft_time, psnr(full, reduced)))
+
+
+def _timed(function, *args, repeat: int = 3) -> float:
+    timings = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        function(*args)
+        timings.append(time.perf_counter() - start)
+    return min(timings)
+
+
+def _float_levels(array, scales):
+    # Reference implementation: levels computed in float64 over every pixel
+    return numpy.dstack([
+        image_filters._linear_level_channel(array[:, :, band], scale)
+        for band, scale in enumerate(scales)
+    ])
+
+
+def benchmark_filters(args):
+    for megapixels in args.megapixels:
+        array = synthetic_array(RESOLUTIONS[megapixels])
+        print("%s MP (%sx%s)" % (megapixels, array.shape[1], array.shape[0]))
+        for filter in FILTERS:
+            print("  %-16s %7.3fs" % (type(filter).__name__, _timed(filter.process_array, array)))
+
+        scales = ((0, 190), (30, 220), (30, 220))
+        reference = _timed(_float_levels, array, scales)
+        lut = _timed(image_filters.ColorLevel(*scales).process_array, array)
+        print("  levels: float64 %.3fs, lookup table %.3fs, speedup x%.1f" % (reference, lut, reference / lut))
+
+        # Black and white points from a subsample against every pixel
+        sampled = image_filters.AutoColorLevel(threshold=1)
+        full = image_filters.AutoColorLevel(threshold=1, samples=0)
+        difference = numpy.abs(numpy.subtract(sampled.levels(array), full.levels(array))).max()
+        print(
+            "  auto levels: every pixel %.3fs, sampled %.3fs, points off by %.1f%s"
+            % (
+                _timed(full.levels, array), _timed(sampled.levels, array), difference,
+                "" if difference <= args.tolerance else " (over %s)" % args.tolerance,
+            )
+        )
+
+
+def _encode(mode: str, template, capture_size, path: Path):
+    # Captures are upscaled from a smaller synthetic image to keep generation out of the peak
+    width, height = capture_size
+    captures = [
+        Image.fromarray(synthetic_array((width // 4, height // 4), seed)).resize(capture_size)
+        for seed in range(template.capture_count)
+    ]
+    layout = template.layout(capture_size)
+    settings = EncoderConfig(low_memory=mode == "low memory")
+
+    rss = current_rss_mb()
+    start = time.perf_counter()
+    if settings.low_memory:
+        save_banded(
+            lambda top, bottom: template.render(layout, captures, top=top, bottom=bottom),
+            layout.size,
+            path,
+            settings,
+        )
+    else:
+        montage = template.process(captures)
+        if mode == "PIL defaults":
+            montage.save(path)
+        else:
+            save_image(montage, path, settings)
+    return time.perf_counter() - start, peak_rss_mb(), peak_rss_mb() - rss, layout.size, path.stat().st_size
+
+
+def benchmark_encode(args):
+    template = getattr(templates, args.template)()
+    capture_size = template.capture_size(args.dpi)
+
+    with tempfile.TemporaryDirectory() as directory:
+        for mode in ("PIL defaults", "configured", "low memory"):
+            elapsed, rss, encode_rss, size, file_size = isolated(
+                _encode, mode, template, capture_size, Path(directory) / "montage.jpg",
+            )
+            print("%-12s %sx%s  render+encode %6.3fs  peak RSS %7.1f MB (+%.1f encoding)  %6.1f kB" % (
+                mode, *size, elapsed, rss, encode_rss, file_size / 1024,
+            ))
+
+
+PRESETS_FILE = Path(__file__).parent / "app" / "configs" / "presets.yml"
+
+
+def pipeline_cases() -> Dict[str, PresetConfig]:
+    # Every preset as configured, every template without filters and every filter alone
+    with open(PRESETS_FILE) as fh:
+        presets = yaml.load(fh, Loader=yaml.FullLoader)["presets"]
+    cases = {
+        "preset:%s" % name: PresetConfig.model_validate(preset)
+        for name, preset in presets.items()
+    }
+    for template in templates.MontageTemplate.__subclasses__():
+        cases["template:%s" % template.__name__] = PresetConfig(
+            template=TemplateConfig(name=template.__name__),
+        )
+    for filter in FILTERS:
+        cases["filter:%s" % type(filter).__name__] = PresetConfig(
+            template=TemplateConfig(name="StripWithTitle"),
+            filters=[FilterConfig(
+                name=type(filter).__name__,
+                params={
+                    field.name: getattr(filter, field.name)
+                    for field in dataclasses.fields(filter) if field.init
+                },
+            )],
+        )
+    return cases
+
+
+def _stages(trace: Trace) -> Dict[str, Dict[str, float]]:
+    # Spans of the same stage, one per capture for instance, are summed
+    stages = defaultdict(lambda: dict(wall=0, cpu=0, allocated_mb=0))
+    for span in trace.to_dict()["spans"]:
+        stage = stages[span["name"]]
+        stage["wall"] += span["duration"]
+        stage["cpu"] += span["cpu"]
+        stage["allocated_mb"] += span.get("allocated", 0) / 1024 / 1024
+    return dict(stages)
+
+
+def _run_pipeline(name: str, preset: PresetConfig, captures: List[Path], title: Path, settings: Dict, repeat: int):
+    processor = CaptureProcessor(
+        ProcessingConfig(
+            preset=name,
+            title=ProcessingConfig.TitleConfig(image_path=title),
+            workers=0,
+            **settings,
+        ),
+        {name: preset},
+    )
+    output = title.parent / ("%s.%s" % (name.replace(":", "_"), processor.settings.output_format))
+
+    # Captures are processed one after another in this process, so the time and memory
+    # of each stage are not mixed with the ones of another stage
+    tracemalloc.start()
+    warm_up = Trace()
+    with warm_up.activate(), tracing.span("warm_up"):
+        processor.warm_up()
+
+    runs = []
+    for _ in range(repeat):
+        trace = Trace()
+        wall, cpu = time.perf_counter(), time.process_time()
+        with trace.activate():
+            images = [processor.pre_process_capture(capture) for capture in captures]
+            processor._assemble(images, output)
+        stages = _stages(trace)
+        stages["total"] = dict(
+            wall=time.perf_counter() - wall,
+            cpu=time.process_time() - cpu,
+            allocated_mb=sum(stage["allocated_mb"] for stage in stages.values()),
+        )
+        runs.append(stages)
+    tracemalloc.stop()
+
+    # The fastest run of each stage, allocations do not depend on the run
+    stages = {
+        stage: {
+            metric: min(run[stage][metric] for run in runs)
+            for metric in runs[0][stage]
+        }
+        for stage in runs[0]
+    }
+    # Kept apart, the warm-up shares span names with the runs but is measured only once
+    return dict(stages=stages, warm_up=_stages(warm_up), peak_rss_mb=peak_rss_mb())
+
+
+def _compare(results: Dict, baseline: Dict, tolerance: float) -> List[str]:
+    # Slower by more than the tolerance, ignoring differences below timer noise
+    regressions = []
+    for case, result in results.items():
+        if case not in baseline:
+            continue
+        for stage, metrics in result["stages"].items():
+            previous = baseline[case]["stages"].get(stage)
+            if previous is None:
+                continue
+            if metrics["wall"] > previous["wall"] * (1 + tolerance) and metrics["wall"] - previous["wall"] > 0.005:
+                regressions.append("%s %s: %.3fs -> %.3fs (+%.0f%%)" % (
+                    case, stage, previous["wall"], metrics["wall"],
+                    (metrics["wall"] / previous["wall"] - 1) * 100,
+                ))
+        if result["peak_rss_mb"] > baseline[case]["peak_rss_mb"] * (1 + tolerance):
+            regressions.append("%s peak RSS: %.1f MB -> %.1f MB" % (
+                case, baseline[case]["peak_rss_mb"], result["peak_rss_mb"],
+            ))
+    return regressions
+
+
+def benchmark_pipeline(args):
+    cases = {
+        name: preset for name, preset in pipeline_cases().items()
+        if not args.only or any(only in name for only in args.only)
+    }
+    settings = dict(draft=args.draft, dpi=args.dpi, encoder=EncoderConfig(low_memory=args.low_memory))
+
+    # tracemalloc sees Python and numpy buffers, not the images allocated inside Pillow
+    print("Allocations are Python and numpy buffers, peak RSS covers the whole run")
+    results = {}
+    with tempfile.TemporaryDirectory() as directory:
+        title = Path(directory) / "title.png"
+        Image.fromarray(synthetic_array((1200, 400), seed=100)).save(title)
+
+        for megapixels in args.megapixels:
+            captures = [
+                synthetic_capture(Path(directory) / ("%smp-%s.jpg" % (megapixels, seed)), megapixels, seed)
+                for seed in range(3)
+            ]
+            print("%s MP" % megapixels)
+            for name, preset in cases.items():
+                result = isolated(_run_pipeline, name, preset, captures, title, settings, args.repeat)
+                results["%s@%sMP" % (name, megapixels)] = result
+                print("  %-40s %7.3fs wall %7.3fs cpu  peak RSS %7.1f MB" % (
+                    name, result["stages"]["total"]["wall"], result["stages"]["total"]["cpu"], result["peak_rss_mb"],
+                ))
+                for stage, metrics in sorted(result["stages"].items()):
+                    if stage != "total":
+                        print("    %-38s %7.3fs wall %7.3fs cpu  %7.1f MB allocated" % (
+                            stage, metrics["wall"], metrics["cpu"], metrics["allocated_mb"],
+                        ))
+                print("    %-38s %7.3fs wall %7.3fs cpu" % (
+                    "warm-up (once)", result["warm_up"]["warm_up"]["wall"], result["warm_up"]["warm_up"]["cpu"],
+                ))
+
+    if args.save:
+        with open(args.save, "w") as fh:
+            json.dump(dict(settings=dict(settings, encoder=settings["encoder"].model_dump()), results=results), fh, indent=2)
+        print("Saved %s" % args.save)
+
+    if args.compare:
+        with open(args.compare) as fh:
+            baseline = json.load(fh)["results"]
+        regressions = _compare(results, baseline, args.tolerance)
+        for regression in regressions:
+            print("REGRESSION %s" % regression)
+        if regressions:
+            sys.exit(1)
+        print("No regression against %s" % args.compare)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the capture processing pipeline")
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    draft = commands.add_parser("draft", help="Compare full and draft JPEG decoding")
+    draft.add_argument("captures", nargs="*", type=Path)
+    draft.add_argument("--megapixels", nargs="+", type=int, choices=RESOLUTIONS, default=[24])
+    draft.add_argument("--template", default="DoubleStripWithTitle")
+    draft.add_argument("--dpi", type=int, default=300)
+    draft.set_defaults(function=benchmark_draft)
+
+    filters = commands.add_parser("filters", help="Time each image filter")
+    filters.add_argument("--megapixels", nargs="+", type=int, choices=RESOLUTIONS, default=[24])
+    filters.add_argument("--tolerance", type=float, default=2, help="Sampled auto levels points may be off by this many levels")
+    filters.set_defaults(function=benchmark_filters)
+
+    encode = commands.add_parser("encode", help="Compare montage encoding modes")
+    encode.add_argument("--template", default="DoubleStripWithTitle")
+    encode.add_argument("--dpi", type=int, default=300)
+    encode.set_defaults(function=benchmark_encode)
+
+    pipeline = commands.add_parser("pipeline", help="Run presets, templates and filters through CaptureProcessor")
+    pipeline.add_argument("--megapixels", nargs="+", type=int, choices=RESOLUTIONS, default=[12, 24])
+    pipeline.add_argument("--only", nargs="+", help="Only run cases containing one of these names")
+    pipeline.add_argument("--repeat", type=int, default=3)
+    pipeline.add_argument("--draft", action="store_true")
+    pipeline.add_argument("--low-memory", action="store_true")
+    pipeline.add_argument("--dpi", type=int, default=300)
+    pipeline.add_argument("--save", type=Path, help="Save the results as a baseline")
+    pipeline.add_argument("--compare", type=Path, help="Fail when slower than a saved baseline")
+    pipeline.add_argument("--tolerance", type=float, default=0.15)
+    pipeline.set_defaults(function=benchmark_pipeline)
+
+    args = parser.parse_args()
+    args.function(args)
+
+
+if __name__ == "__main__":
+    main()
@@ -1,37 +1,270 @@
 import asyncio
 import logging
-from math import sqrt
 import os
 from pathlib import Path
+import threading
 import time
+from typing import TYPE_CHECKING, Dict, List, Optional, Union
 
 from gpiozero import LED, Button
 
-from app.camera import Camera
-from app.capture import capture_multiple_photos
+from app.feedback import FeedbackEngine, blink, countdown, flash, pulse
+from app.input import InputController
 from app.machine import PhotoBoothMachine
-from app.process import CaptureProcessor
 from app.config import PhotoBoothConfig
-from app.printer import print_image
+from app.config_watcher import ConfigWatcher
+from app.entities import Capture
+from app.print_queue import PrintQueue
+from app.sessions import CAPTURED, DONE, FAILED, PROCESSED, SessionStore, clean_up, session_id
+from app import tracing
+from app.tracing import Trace
+from app.transfer import TransferServer
+
+# gphoto2, Pillow, numpy and OpenCV take seconds to import on a Raspberry Pi, they are
+# imported by the start-up thread once the button is already taking presses
+if TYPE_CHECKING:
+    from app.camera import Camera
+    from app.gallery import Gallery
+    from app.live_view import LiveView
+    from app.process import CaptureProcessor, ProcessingSession
 
 
 class GenericPhotoBooth(PhotoBoothMachine):
-    def __init__(self, config: PhotoBoothConfig):
-        super().__init__()
+    camera: Optional["Camera"] = None
+    processor: Optional["CaptureProcessor"] = None
+    processing_session: Optional["ProcessingSession"] = None
+    trace: Optional[Trace] = None
+    live_view: Optional["LiveView"] = None
+    pressed_at: Optional[float] = None
+    gallery: Optional["Gallery"] = None
+
+    def __init__(self, config: PhotoBoothConfig, started_at: Optional[float] = None):
         self.config = config
-        self.camera = Camera(folder=config.camera.output_directory)
-        self.processor = CaptureProcessor(
-            settings=self.config.processing,
-            presets=self.config.presets,
+        self.started_at = time.monotonic() if started_at is None else started_at
+        self.startup_times: Dict[str, float] = {}
+        self.ready = threading.Event()
+        # Held for the whole of a session, configuration changes are applied in between
+        self.session_lock = threading.Lock()
+
+        # Sessions run on the input worker, one at a time, whatever thread the press came
+        # from. Presses are taken from the start and wait for the booth to be ready.
+        self.input = InputController(
+            session=self._session,
+            settings=self.config.gpio,
         )
+        self.input.start()
+        super().__init__()
+        self._startup_step("input")
+
+        self.print_queue = PrintQueue(
+            directory=self.config.printing.queue_directory,
+            settings=self.config.printing,
+        )
+        if self.config.printing.enabled:
+            self.print_queue.start()
 
         # Prepare output directories
         os.makedirs(self.config.camera.output_directory, exist_ok=True)
         os.makedirs(self.config.processing.tmp_directory, exist_ok=True)
         os.makedirs(self.config.processing.output_directory, exist_ok=True)
+        # Montages left half written by a crash, nothing else writes there yet
+        clean_up(self.config.processing.tmp_directory, before=time.time())
+        self.sessions = SessionStore(self.config.sessions.database)
+
+        # Push processed images to the print side as soon as they are ready
+        self.transfer = None
+        if self.config.remote.serve:
+            self.transfer = TransferServer(
+                directory=self.config.processing.output_directory,
+                ledger=self.config.remote.ledger,
+                host=self.config.remote.listen_host,
+                port=self.config.remote.port,
+                token=self.config.remote.token,
+            )
+            self.transfer.start()
+        self._startup_step("services")
+
+        threading.Thread(target=self._start_up, name="start-up", daemon=True).start()
+
+    def _startup_step(self, name: str):
+        self.startup_times[name] = time.monotonic() - self.started_at
+
+    def startup_report(self) -> str:
+        steps = ["%s %.2fs" % (name, elapsed) for name, elapsed in self.startup_times.items()]
+        return "Start-up: %s" % ", ".join(steps)
+
+    def _start_up(self):
+        try:
+            from app.camera import Camera
+            from app.process import CaptureProcessor
+
+            self.camera = Camera(
+                folder=self.config.camera.output_directory,
+                keep_alive=self.config.camera.keep_alive,
+                reconnect_attempts=self.config.camera.reconnect_attempts,
+                reconnect_delay=self.config.camera.reconnect_delay,
+            )
+            self.processor = CaptureProcessor(
+                settings=self.config.processing,
+                presets=self.config.presets,
+            )
+            # Built now, the warm-up and the first guest then share the same engine
+            self.processor.engine
+            self._startup_step("imports")
+
+            # Open the camera session once, it stays open between guests
+            try:
+                asyncio.run(self.camera.init())
+            except Exception as e:
+                logging.error("Camera is not ready yet: %s", e)
+            self.camera.start_keep_alive()
+            self._startup_step("camera")
+
+            # Guests see themselves while waiting and during the countdown
+            if self.config.camera.live_view.enabled:
+                from app.live_view import LiveView
+
+                self.live_view = LiveView(self.camera, self.config.camera.live_view)
+                self.live_view.start()
+
+            if self.config.gallery.enabled:
+                from app.gallery import Gallery
+
+                self.gallery = Gallery(self.config.gallery)
+                self.gallery.start()
+
+            if self.config.reload_interval:
+                ConfigWatcher(
+                    files=type(self.config).config_files,
+                    load=type(self.config).load,
+                    on_change=self.apply_config,
+                    interval=self.config.reload_interval,
+                ).start()
+        except BaseException:
+            # Same as failing in the constructor: the service stops and is restarted
+            logging.exception("Could not start the photo booth")
+            os._exit(1)
+
+        self._startup_step("ready")
+        self.ready.set()
+
+        # A dummy capture goes through the whole pipeline and starts the workers, a guest
+        # pressing the button meanwhile is not kept waiting for it
+        try:
+            self.processor.warm_up(dummy=True)
+        except Exception as e:
+            logging.error("Could not warm up the processing: %s", e)
+        self._startup_step("warm-up")
+        logging.info(self.startup_report())
+
+        if self.config.sessions.resume:
+            threading.Thread(target=self._resume, name="resume", daemon=True).start()
+
+    def _resume(self):
+        # Captures being archived for a guest since the start are left alone
+        started = time.time() - (time.monotonic() - self.started_at)
+        clean_up(self.config.camera.output_directory, before=started, pattern="*.part")
+
+        processors: Dict[Optional[str], "CaptureProcessor"] = {}
+        for session in self.sessions.unfinished():
+            # One session at a time, guests pressing the button get their turn in between
+            with self.session_lock:
+                try:
+                    preset = self._resume_preset(session)
+                    file_path = session["output"]
+                    if session["state"] == CAPTURED or file_path is None or not file_path.is_file():
+                        missing = [str(path) for path in session["captures"] if not path.is_file()]
+                        if missing:
+                            logging.error("Cannot resume session %s, missing %s", session["id"], ", ".join(missing))
+                            self.sessions.update(session["id"], FAILED)
+                            continue
+                        if preset not in processors:
+                            processors[preset] = self._preset_processor(preset)
+                        file_path = self._process(session["id"], session["captures"], processor=processors[preset])
+                    self._deliver(session["id"], file_path, session["captures"], preset)
+                except Exception as e:
+                    logging.error("Could not resume session %s: %s", session["id"], e)
+                else:
+                    print("Resumed session %s" % session["id"])
+
+    def _resume_preset(self, session: Dict) -> Optional[str]:
+        # Sessions are rendered again with the preset they were taken with
+        preset = session["preset"]
+        if preset is None or preset not in self.config.presets:
+            if preset is not None:
+                logging.warning(
+                    "Preset %s of session %s does not exist anymore, using %s",
+                    preset, session["id"], self.config.processing.preset,
+                )
+            return self.config.processing.preset
+        return preset
+
+    def _preset_processor(self, preset: Optional[str]) -> "CaptureProcessor":
+        if preset == self.config.processing.preset:
+            return self.processor
+        from app.process import CaptureProcessor
+
+        # Processed on a thread, the workers of the running processor keep their preset
+        settings = self.config.processing.model_copy(update={"preset": preset, "workers": 0})
+        return CaptureProcessor(settings, self.config.presets)
+
+    def _session(self, pressed_at: Optional[float] = None):
+        self.ready.wait()
+        with self.session_lock:
+            self.pressed_at = pressed_at
+            self.registered_input(pressed=True)
+
+    def apply_config(self, config: PhotoBoothConfig):
+        previous = self.config
+        if config == previous:
+            return
+
+        # Everything that can fail is tried first, on a processor of its own: presets,
+        # title and directories. Nothing of the running booth is changed until it worked.
+        processing_changed = config.processing != previous.processing or config.presets != previous.presets
+        if processing_changed:
+            from app.process import CaptureProcessor
+
+            CaptureProcessor(config.processing, config.presets).warm_up()
+        os.makedirs(config.camera.output_directory, exist_ok=True)
+        os.makedirs(config.processing.tmp_directory, exist_ok=True)
+        os.makedirs(config.processing.output_directory, exist_ok=True)
+
+        with self.session_lock:
+            if processing_changed:
+                self.processor.configure(config.processing, config.presets)
+
+            self.camera.folder = config.camera.output_directory
+            self.camera.keep_alive = config.camera.keep_alive
+            self.camera.reconnect_attempts = config.camera.reconnect_attempts
+            self.camera.reconnect_delay = config.camera.reconnect_delay
+            if self.live_view is not None:
+                self.live_view.settings = config.camera.live_view
+
+            self.print_queue.settings = config.printing
+            if config.printing.enabled:
+                self.print_queue.start()
+            self.input.settings = config.gpio
+            self.config = config
+            self.processor.warm_up()
+
+            restart = [
+                name for name, changed in (
+                    ("GPIO pins", (config.gpio.button, config.gpio.led) != (previous.gpio.button, previous.gpio.led)),
+                    ("live view server", config.camera.live_view.model_dump(include={"enabled", "host", "port"})
+                        != previous.camera.live_view.model_dump(include={"enabled", "host", "port"})),
+                    ("print queue directory", config.printing.queue_directory != previous.printing.queue_directory),
+                    ("remote", config.remote != previous.remote),
+                    ("gallery", config.gallery != previous.gallery),
+                    ("session database", config.sessions.database != previous.sessions.database),
+                ) if changed
+            ]
+            if restart:
+                logging.warning("Restart the service to apply changes to: %s", ", ".join(restart))
+            print("Configuration reloaded")
 
     def _before_timer_callback(self):
-        time.sleep(self.config.camera.delay)
+        pass
 
     def _capture_callback(self):
         pass
@@ -42,90 +275,183 @@ class GenericPhotoBooth(PhotoBoothMachine):
     def _printing_callback(self):
         pass
 
+    def _countdown(self):
+        self.input.countdown.set()
+        if self.live_view is not None:
+            self.live_view.resume()
+        self._before_timer_callback()
+
+    def _shutter(self):
+        self.input.countdown.clear()
+        # The preview frame in flight is the only thing the shutter may wait for
+        if self.live_view is not None:
+            self.live_view.pause()
+        self._capture_callback()
+
+    def _write_trace(self, **attributes):
+        # One line per session, summarized by trace_report.py
+        if self.config.tracing.enabled and self.trace is not None:
+            self.trace.attributes.update(attributes)
+            try:
+                self.trace.write(self.config.tracing.path)
+            except OSError as e:
+                logging.error(e)
+        self.trace = None
+
     def on_enter_initialization(self):
         self.initialized()
 
+    def on_enter_waiting(self):
+        if self.live_view is not None:
+            self.live_view.resume()
+
     def on_enter_capturing(self):
+        from app.capture import capture_multiple_photos
+
         capture_count = self.config.camera.count
         if capture_count == "template":
             capture_count = self.processor.template.capture_count
 
+        # The session starts when the button is pressed, waiting for the booth included
+        pressed_at, self.pressed_at = self.pressed_at, None
+        self.trace = Trace(start=pressed_at, captures=capture_count)
+
+        session = None
+        if self.config.processing.pipelined:
+            session = self.processor.start_session()
+
         try:
-            captures = asyncio.run(
-                capture_multiple_photos(
-                    count=capture_count,
-                    self_timer_seconds=0, # self.config.camera.delay
-                    before_timer_callback=self._before_timer_callback,
-                    capture_callback=self._capture_callback,
-                    exception_callback=self._exception_callback,
-                    camera=self.camera,
+            with self.trace.activate():
+                captures = asyncio.run(
+                    capture_multiple_photos(
+                        count=capture_count,
+                        self_timer_seconds=self.config.camera.delay,
+                        before_timer_callback=self._countdown,
+                        capture_callback=self._shutter,
+                        exception_callback=self._exception_callback,
+                        saved_callback=session.submit if session is not None else None,
+                        camera=self.camera,
+                        cancel_event=self.input.cancel,
+                        pressed_at=pressed_at,
+                    )
                 )
-            )
         except Exception as e:
             logging.error(e)
+            if session is not None:
+                session.cancel()
+            self._write_trace(error=str(e))
             self.failed()
         else:
+            self.processing_session = session
             self.captured(captures=captures)
 
     def on_enter_processing(self):
-        file_name = Path("%s.%s" % (
-            int(time.time()),
-            self.config.processing.output_format,
-        ))
+        captures = self.images_to_process
+        # Used once, a later session without pipelining must not assemble this one again
+        processing_session, self.processing_session = self.processing_session, None
+        session = session_id(captures)
+        capture_paths = [capture.path if isinstance(capture, Capture) else capture for capture in captures]
+        self.sessions.record(session, capture_paths, self.config.processing.preset)
+
+        trace = self.trace or Trace()
+        try:
+            with trace.activate():
+                file_path = self._process(session, captures, processing_session)
+                self._deliver(session, file_path, capture_paths, self.config.processing.preset, trace)
+        except Exception as e:
+            # Back to waiting, left in processing the booth would ignore every press
+            logging.error("Could not process session %s: %s: %s", session, type(e).__name__, e)
+            if processing_session is not None:
+                processing_session.cancel()
+            self.sessions.update(session, FAILED)
+            self._write_trace(session=session, error=str(e))
+            self.failed()
+            return
+        self._write_trace(session=session, output=file_path.name)
+        self.processed(processed_image=file_path)
+
+    def _process(
+        self,
+        session: str,
+        captures: List[Union[Path, Capture]],
+        processing_session: Optional["ProcessingSession"] = None,
+        processor: Optional["CaptureProcessor"] = None,
+    ) -> Path:
+        # Named after the captures, two sessions never share a file
+        file_name = Path("%s.%s" % (session, self.config.processing.output_format))
         tmp_file_path = self.config.processing.tmp_directory / file_name
-        self.processor.process(
-            captures=self.images_to_process,
-            output_file_path=tmp_file_path,
-        )
+        if processing_session is not None:
+            processing_session.process(output_file_path=tmp_file_path)
+        else:
+            (processor or self.processor).process(
+                captures=captures,
+                output_file_path=tmp_file_path,
+            )
         file_path = self.config.processing.output_directory / file_name
-        os.rename(tmp_file_path, file_path)
-        self.processed(processed_image=file_path)
+        with tracing.span("rename"):
+            os.replace(tmp_file_path, file_path)
+        self.sessions.update(session, PROCESSED, output=file_path)
+        return file_path
 
-    def on_enter_printing(self):
-        print("Printing processed image...")
+    def _deliver(
+        self,
+        session: str,
+        file_path: Path,
+        captures: List[Path],
+        preset: Optional[str],
+        trace: Optional[Trace] = None,
+    ):
+        if self.transfer is not None:
+            self.transfer.publish(file_path)
+
+        # The printer is fed by the print queue, the booth is free for the next guest
         if self.config.printing.enabled:
-            print_image(
-                self.image_to_print,
-                format=self.processor.template.format,
-                settings=self.config.printing,
-            )
+            with tracing.span("print_submit"):
+                # Keyed by session, a session resumed after a crash is not printed twice
+                depth = self.print_queue.submit(file_path, key=session)
+            print("Queued processed image for printing (%s in queue)" % depth)
         else:
             print("Skipped printing")
+
+        if self.gallery is not None:
+            self.gallery.add(
+                session=session,
+                montage=file_path,
+                captures=captures,
+                preset=preset,
+                timings=tracing.stage_totals(trace.to_dict()) if trace is not None else {},
+            )
+        # The print job is on disk by now, a crash from here on does not lose it
+        self.sessions.update(session, DONE)
+
+    def on_enter_printing(self):
         self._printing_callback()
-        time.sleep(self.config.printing.delay)
         self.printed()
 
 
 class RaspberryPiPhotoBooth(GenericPhotoBooth):
-    def __init__(self, config: PhotoBoothConfig):
+    def __init__(self, config: PhotoBoothConfig, started_at: Optional[float] = None):
         self.button = Button(pin=config.gpio.button)
         self.led = LED(pin=config.gpio.led)
-        super().__init__(config=config)
+        # LED patterns play on their own thread, callbacks return right away
+        self.feedback = FeedbackEngine(self.led)
+        self.feedback.start()
+        super().__init__(config=config, started_at=started_at)
 
     def _before_timer_callback(self):
-        # Blink the LED faster when the timer is about to end
-        self.led.off()
-        periods = [0.5, 0.4, 0.3, 0.25, 0.2, 0.15, 0.1]
-        start_time = time.time()
-        blink_count = 0
-        while time.time() - start_time < self.config.camera.delay:
-            period = periods[min(blink_count, len(periods) - 1)]
-            self.led.blink(on_time=period, off_time=period, n=1, background=False)
-            blink_count += 1
+        # Blink the LED faster when the timer is about to end, the self-timer runs alongside
+        self.feedback.play(countdown(self.config.camera.delay))
 
     def _capture_callback(self):
-        self.led.blink(on_time=1, off_time=0, n=1)
+        self.feedback.play(flash(1))
 
     def _exception_callback(self):
-        self.led.off()
+        self.feedback.stop()
 
     def _printing_callback(self):
-        if self.config.printing.delay:
-            self.led.blink(on_time=0.1, off_time=0.1, n=self.config.printing.delay * 5)
-        else:
-            self.led.blink(on_time=0.1, off_time=0.1, n=5)
+        self.feedback.play(pulse(0.1, self.config.printing.delay or 1))
 
     def on_enter_initialization(self):
-        self.button.when_activated = lambda: self.registered_input(pressed=True)
-        self.led.blink(on_time=0.2, off_time=0.2, n=3)
+        self.button.when_activated = lambda: self.input.press()
+        self.feedback.play(blink(on_time=0.2, off_time=0.2, count=3))
         self.initialized()
@@ -0,0 +1,61 @@
+import argparse
+import logging
+import os
+from pathlib import Path
+import shutil
+import subprocess
+
+from app.config import PrintingConfig
+from app.printer import print_image
+from app.watcher import DirectoryWatcher
+
+
+def convert_heic(file: Path, converted_directory: Path) -> Path:
+    # The printer only takes JPEG. Converting outside of the watched directory keeps the
+    # converted file from being picked up a second time, the original is kept aside.
+    converted = converted_directory / (file.name + ".JPG")
+    subprocess.check_call(["magick", str(file), str(converted)])
+    shutil.move(file, converted_directory)
+    return converted
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Print every image of a directory")
+    parser.add_argument("directory", type=Path)
+    parser.add_argument("--watch", action="store_true", help="Keep printing the images dropped in afterwards")
+    parser.add_argument("-d", "--destination")
+    parser.add_argument("-o", "--option", dest="options", action="append", default=[])
+    parser.add_argument("--copies", type=int, default=1)
+    parser.add_argument("--poll-interval", type=float, default=1)
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.INFO)
+
+    settings = PrintingConfig(
+        enabled=True,
+        copies=args.copies,
+        destination=args.destination,
+        options=args.options,
+    )
+    printed_directory = args.directory / "printed"
+    converted_directory = args.directory / "converted"
+    os.makedirs(printed_directory, exist_ok=True)
+    os.makedirs(converted_directory, exist_ok=True)
+
+    watcher = DirectoryWatcher(
+        args.directory,
+        suffixes=(".jpg", ".jpeg", ".heic"),
+        poll_interval=args.poll_interval,
+    )
+    for file in watcher if args.watch else watcher.existing():
+        print(file)
+        try:
+            if file.suffix.lower() == ".heic":
+                file = convert_heic(file, converted_directory)
+            print_image(file, format=None, settings=settings)
+            shutil.move(file, printed_directory)
+        except Exception as e:
+            logging.error(e)
+
+
+if __name__ == "__main__":
+    main()
@@ -1,3 +1,7 @@
+import time
+
+started_at = time.monotonic()
+
 from signal import pause
 
 from app.config import PhotoBoothConfig
@@ -5,6 +9,6 @@ from machine import RaspberryPiPhotoBooth
 
 
 if __name__ == "__main__":
-    photo_booth = RaspberryPiPhotoBooth(config=PhotoBoothConfig.load())
+    photo_booth = RaspberryPiPhotoBooth(config=PhotoBoothConfig.load(), started_at=started_at)
     print('Ready. To start taking pictures, press on the button')
     pause()
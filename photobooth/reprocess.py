@@ -0,0 +1,170 @@
+import argparse
+from concurrent.futures import ProcessPoolExecutor, as_completed
+import json
+import logging
+import os
+from pathlib import Path
+import sys
+import time
+from typing import Dict, List, Optional, Tuple
+
+from app import registry
+from app.config import PhotoBoothConfig, ProcessingConfig, PresetConfig
+from app.process import CaptureProcessor
+from app.sessions import SessionStore, content_hash, session_id
+
+
+CAPTURE_SUFFIXES = (".jpg", ".jpeg", ".png")
+MANIFEST = "reprocessed.jsonl"
+
+# Set in each worker process by _init_worker
+_processor: Optional[CaptureProcessor] = None
+_output_directory: Path = Path()
+_fingerprint: str = ""
+_rendered: Dict[str, str] = {}
+
+
+def fingerprint(settings: ProcessingConfig, preset: PresetConfig) -> str:
+    # Everything that changes the rendered montage, an output rendered with another
+    # fingerprint is out of date
+    title = settings.title.image_path
+    return content_hash(json.dumps([
+        settings.model_dump(mode="json", include={"title", "correct_orientation", "draft", "dpi", "output_format", "encoder"}),
+        preset.model_dump(mode="json"),
+        os.stat(title).st_mtime_ns if title is not None else None,
+    ], sort_keys=True).encode())
+
+
+def group_captures(directory: Path, count: int) -> List[Tuple[Optional[str], List[Path]]]:
+    # Captures are named after their content, the order they were taken in is the order
+    # they were written in
+    captures = sorted(
+        (path for path in directory.iterdir() if path.suffix.lower() in CAPTURE_SUFFIXES),
+        key=lambda path: (path.stat().st_mtime, path.name),
+    )
+    if len(captures) % count:
+        logging.warning("Ignoring the last %s captures, not enough for a session", len(captures) % count)
+    return [(None, captures[index:index + count]) for index in range(0, len(captures) - count + 1, count)]
+
+
+def stored_sessions(database: Path) -> List[Tuple[Optional[str], List[Path]]]:
+    return [(session["id"], session["captures"]) for session in SessionStore(database).sessions()]
+
+
+def _init_worker(settings: ProcessingConfig, presets: Dict[str, PresetConfig], output_directory: Path, fingerprint: str, rendered: Dict[str, str]):
+    global _processor, _output_directory, _fingerprint, _rendered
+    # Sessions are spread over the processes, each renders its captures on its own
+    _processor = CaptureProcessor(settings.model_copy(update={"workers": 0}), presets)
+    _output_directory = output_directory
+    _fingerprint = fingerprint
+    _rendered = rendered
+
+
+def _render(session: Optional[str], captures: List[Path], force: bool) -> Tuple[str, bool]:
+    # Hashing the captures gives the session and file name the booth used for them
+    if session is None:
+        session = session_id(captures)
+    file_path = _output_directory / ("%s.%s" % (session, _processor.settings.output_format))
+    if not force and _rendered.get(session) == _fingerprint and file_path.is_file():
+        return session, False
+
+    # Hidden until complete, with the extension the encoder is picked from
+    tmp_file_path = file_path.with_name(".%s" % file_path.name)
+    _processor.process(captures=captures, output_file_path=tmp_file_path)
+    os.replace(tmp_file_path, file_path)
+    return session, True
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Render archived sessions again, with another preset or title")
+    parser.add_argument("source", type=Path, nargs="?", help="Directory of captures or session database, defaults to the configured database")
+    parser.add_argument("-o", "--output-directory", type=Path, required=True)
+    parser.add_argument("--preset")
+    parser.add_argument("--title", type=Path)
+    parser.add_argument("--jobs", type=int, default=os.cpu_count())
+    parser.add_argument("--draft", action="store_true")
+    parser.add_argument("--force", action="store_true", help="Render sessions that are up to date too")
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.INFO)
+
+    config = PhotoBoothConfig.load()
+    update = {}
+    if args.preset is not None:
+        update["preset"] = args.preset
+    if args.title is not None:
+        update["title"] = config.processing.title.model_copy(update={"image_path": args.title})
+    if args.draft:
+        update["draft"] = True
+    settings = config.processing.model_copy(update=update)
+    try:
+        preset = registry.resolve(settings, config.presets)
+        # Captures of a directory are grouped by as many as the template takes
+        count = registry.template(preset.template).capture_count
+    except ValueError as e:
+        sys.exit(str(e))
+
+    source = args.source or config.sessions.database
+    if source.is_dir():
+        sessions = group_captures(source, count)
+    else:
+        sessions = stored_sessions(source)
+    print("%s sessions to render with %s" % (len(sessions), settings.preset or preset.template.name))
+
+    # Sessions rendered by previous runs and the settings they were rendered with
+    os.makedirs(args.output_directory, exist_ok=True)
+    manifest = args.output_directory / MANIFEST
+    rendered: Dict[str, str] = {}
+    if manifest.is_file():
+        with open(manifest) as fh:
+            for line in fh:
+                try:
+                    entry = json.loads(line)
+                except json.JSONDecodeError:
+                    continue
+                rendered[entry["session"]] = entry["fingerprint"]
+    current = fingerprint(settings, preset)
+
+    started = time.monotonic()
+    done = skipped = failed = captures_done = 0
+    with ProcessPoolExecutor(
+        max_workers=args.jobs,
+        initializer=_init_worker,
+        initargs=(settings, config.presets, args.output_directory, current, rendered),
+    ) as executor, open(manifest, "a") as fh:
+        futures = {
+            executor.submit(_render, session, captures, args.force): captures
+            for session, captures in sessions
+        }
+        for future in as_completed(futures):
+            try:
+                session, rendered_now = future.result()
+            except Exception as e:
+                logging.error("Could not render %s: %r", ", ".join(str(path) for path in futures[future]), e)
+                failed += 1
+            else:
+                if rendered_now:
+                    fh.write(json.dumps(dict(session=session, fingerprint=current)) + "\n")
+                    fh.flush()
+                    captures_done += len(futures[future])
+                else:
+                    skipped += 1
+            done += 1
+
+            elapsed = time.monotonic() - started
+            rate = (done - skipped - failed) / elapsed
+            print(
+                "\r%s/%s sessions, %s skipped, %s failed, %.2f sessions/s, %.1f captures/s, %s left"
+                % (
+                    done, len(sessions), skipped, failed, rate, captures_done / elapsed,
+                    "%.0fs" % ((len(sessions) - done) / rate) if rate else "-",
+                ),
+                end="",
+                flush=True,
+            )
+    print("\nRendered %s sessions in %.1fs" % (done - skipped - failed, time.monotonic() - started))
+    if failed:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
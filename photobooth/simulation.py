@@ -1,29 +1,40 @@
+import argparse
 from pathlib import Path
 import platform
 import subprocess
 import time
 
 from app.config import PhotoBoothConfig
+from benchmark import RESOLUTIONS, synthetic_capture
 from machine import GenericPhotoBooth
 
 
 class SimulatedPhotoBooth(GenericPhotoBooth):
+    megapixels: int = 24
+
     def on_enter_capturing(self):
-        for i in range(0, 3):
+        # Synthetic captures stand in for the camera
+        captures = []
+        for i in range(0, self.processor.template.capture_count):
             print("Capturing fake image %s" % (i + 1))
             time.sleep(self.config.camera.delay)
-
-        captures = [
-            Path("/Users/cgitton/Desktop/photobooth/IMG_0101.tiff"),
-            Path("/Users/cgitton/Desktop/photobooth/IMG_0102.tiff"),
-            Path("/Users/cgitton/Desktop/photobooth/IMG_0103.tiff"),
-        ]
+            captures.append(synthetic_capture(
+                Path(self.config.camera.output_directory) / ("simulated-%s.jpg" % i),
+                self.megapixels,
+                seed=i,
+            ))
         print(captures)
         self.captured(captures=captures)
 
 
 if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Run a session of the photo booth without a camera")
+    parser.add_argument("--megapixels", type=int, choices=RESOLUTIONS, default=24)
+    args = parser.parse_args()
+
+    SimulatedPhotoBooth.megapixels = args.megapixels
     photo_booth = SimulatedPhotoBooth(config=PhotoBoothConfig.load())
+    photo_booth.ready.wait()
     photo_booth.registered_input(pressed=True)
 
     print(photo_booth.image_to_print)
@@ -0,0 +1,49 @@
+import argparse
+from collections import defaultdict
+import json
+from pathlib import Path
+from typing import Dict, List
+
+import numpy
+
+from app.config import TracingConfig
+from app.tracing import stage_totals
+
+
+def load_sessions(path: Path, last: int = 0) -> List[Dict]:
+    with open(path) as fh:
+        sessions = [json.loads(line) for line in fh if line.strip()]
+    return sessions[-last:] if last else sessions
+
+
+def stage_durations(sessions: List[Dict]) -> Dict[str, List[float]]:
+    durations: Dict[str, List[float]] = defaultdict(list)
+    for session in sessions:
+        for name, duration in stage_totals(session).items():
+            durations[name].append(duration)
+    return durations
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Summarize the latency of each stage of recorded sessions")
+    parser.add_argument("path", nargs="?", type=Path, default=TracingConfig().path)
+    parser.add_argument("--last", type=int, default=0, help="Only use the last sessions")
+    parser.add_argument("--all", action="store_true", help="Include failed sessions")
+    args = parser.parse_args()
+
+    sessions = load_sessions(args.path, args.last)
+    failed = [session for session in sessions if "error" in session]
+    if not args.all:
+        sessions = [session for session in sessions if "error" not in session]
+    print("%s sessions (%s failed)" % (len(sessions), len(failed)))
+    if not sessions:
+        return
+
+    print("%-28s %6s %9s %9s %9s" % ("stage", "count", "p50", "p95", "max"))
+    for name, values in sorted(stage_durations(sessions).items(), key=lambda item: -numpy.median(item[1])):
+        p50, p95 = numpy.percentile(values, [50, 95])
+        print("%-28s %6s %8.3fs %8.3fs %8.3fs" % (name, len(values), p50, p95, max(values)))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,73 @@
+import numpy
+from PIL import Image
+import pytest
+
+from app.image_filters import (
+    AutoColorLevel,
+    BlackAndWhite,
+    ColorLevel,
+    Inverted,
+    LevelImage,
+    MirrorImage,
+    histogram,
+    percentile,
+)
+from app.image_helpers import FilterPipeline, FusedLut
+
+
+def synthetic_image(mode: str, size=(211, 157)):
+    rng = numpy.random.default_rng(0)
+    width, height = size
+    array = (rng.random((height, width, 4)) * 180 + 30).astype(numpy.uint8)
+    return Image.fromarray(array, "RGBA").convert(mode)
+
+
+@pytest.mark.parametrize("mode", ["L", "RGB", "RGBA"])
+def test_fused_chain_equals_sequential_filters(mode):
+    image = synthetic_image(mode)
+    filters = [
+        ColorLevel(red=(20, 200), green=(10, 240)),
+        Inverted(),
+        ColorLevel(blue=(40, 180)),
+        MirrorImage(),
+        AutoColorLevel(threshold=1),
+        Inverted(),
+        ColorLevel(red=(5, 250)),
+    ]
+    pipeline = FilterPipeline(filters)
+    assert [type(step) for step in pipeline.steps] == [FusedLut, MirrorImage, AutoColorLevel, FusedLut]
+
+    expected = image
+    for filter in filters:
+        expected = filter.process(expected)
+    result = pipeline.process(image)
+
+    assert result.mode == mode
+    assert numpy.array_equal(numpy.asarray(result), numpy.asarray(expected))
+
+
+@pytest.mark.parametrize("q", [0, 0.5, 1, 2.5, 5, 50, 95, 99.5, 100])
+@pytest.mark.parametrize("size", [1, 2, 1000, 12345])
+def test_percentile_equals_numpy(q, size):
+    # Skewed, with most of the values piled up at the dark end
+    values = (numpy.random.default_rng(size).random(size) ** 3 * 256).astype(numpy.uint8)
+
+    assert percentile(histogram(values), q) == pytest.approx(numpy.percentile(values, q))
+
+
+@pytest.mark.parametrize("filter", [LevelImage(), AutoColorLevel(threshold=1), AutoColorLevel(samples=0), ColorLevel(red=(20, 200))])
+def test_level_filters_on_gray_images(filter):
+    image = synthetic_image("L")
+
+    result = filter.process(image)
+
+    # A gray image is levelled like each band of the same image in RGB
+    assert result.mode == "L"
+    expected = numpy.asarray(filter.process(image.convert("RGB")))[:, :, 0]
+    assert numpy.array_equal(numpy.asarray(result), expected)
+
+
+def test_black_and_white_keeps_gray_images():
+    image = synthetic_image("L")
+
+    assert numpy.array_equal(numpy.asarray(BlackAndWhite().process(image)), numpy.asarray(image))
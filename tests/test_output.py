@@ -0,0 +1,68 @@
+import numpy
+from PIL import Image
+import pytest
+
+from app import templates
+from app.config import EncoderConfig, PresetConfig, ProcessingConfig, TemplateConfig
+from app.output import save_banded, save_image
+from app.process import CaptureProcessor
+
+
+def synthetic_image(size):
+    # Smooth gradients with some noise, close enough to a photo for the encoder
+    width, height = size
+    y, x = numpy.mgrid[0:height, 0:width]
+    noise = numpy.random.default_rng(0).integers(0, 32, (height, width, 3))
+    array = numpy.dstack((x * 255 // width, y * 255 // height, (x + y) * 255 // (width + height))) + noise
+    return Image.fromarray(numpy.clip(array, 0, 255).astype(numpy.uint8))
+
+
+@pytest.mark.parametrize("subsampling", ["4:2:0", "4:4:4"])
+@pytest.mark.parametrize("band_height", [37, 100, 5000])
+def test_banded_jpeg_decodes_like_a_full_encode(tmp_path, band_height, subsampling):
+    # Neither the width nor the height are a multiple of the 16 pixels MCU
+    image = synthetic_image((1001, 733))
+    settings = EncoderConfig(low_memory=True, band_height=band_height, subsampling=subsampling)
+
+    save_image(image, tmp_path / "full.jpg", settings)
+    save_banded(lambda top, bottom: image.crop((0, top, image.width, bottom)), image.size, tmp_path / "banded.jpg", settings)
+
+    with Image.open(tmp_path / "full.jpg") as full, Image.open(tmp_path / "banded.jpg") as banded:
+        assert banded.size == image.size
+        assert numpy.array_equal(numpy.asarray(banded), numpy.asarray(full))
+
+
+def test_banded_non_jpeg_is_saved_whole(tmp_path):
+    image = synthetic_image((101, 67))
+    save_banded(lambda top, bottom: image.crop((0, top, image.width, bottom)), image.size, tmp_path / "banded.png", EncoderConfig())
+
+    with Image.open(tmp_path / "banded.png") as banded:
+        assert numpy.array_equal(numpy.asarray(banded), numpy.asarray(image))
+
+
+@pytest.mark.parametrize("template", [template.__name__ for template in templates.MontageTemplate.__subclasses__()])
+def test_low_memory_montage_decodes_like_a_full_encode(tmp_path, template):
+    synthetic_image((400, 300)).save(tmp_path / "title.png")
+    captures = []
+    for index in range(4):
+        captures.append(tmp_path / ("capture-%s.jpg" % index))
+        synthetic_image((1001 + index, 733)).save(captures[-1])
+
+    outputs = []
+    for low_memory in (False, True):
+        settings = ProcessingConfig(
+            preset="case",
+            title=ProcessingConfig.TitleConfig(image_path=tmp_path / "title.png"),
+            # Montages of a few hundred pixels, none of their sides a multiple of 16
+            draft=True,
+            dpi=97,
+            encoder=EncoderConfig(low_memory=low_memory, band_height=37),
+        )
+        processor = CaptureProcessor(settings, {"case": PresetConfig(template=TemplateConfig(name=template))})
+        images = [processor.pre_process_capture(capture) for capture in captures[:processor.template.capture_count]]
+        outputs.append(tmp_path / ("montage-%s.jpg" % low_memory))
+        processor._assemble(images, outputs[-1])
+
+    with Image.open(outputs[0]) as full, Image.open(outputs[1]) as banded:
+        assert banded.size == full.size
+        assert numpy.array_equal(numpy.asarray(banded), numpy.asarray(full))
@@ -0,0 +1,120 @@
+import json
+import time
+
+import pytest
+
+from app import print_queue
+from app.config import PrintingConfig
+from app.print_queue import PrintQueue
+
+
+class Calls(list):
+    # Images handed to the printer, print_image returns what results holds for them
+    results: dict
+
+
+@pytest.fixture
+def printed(monkeypatch):
+    calls = Calls()
+    results = {}
+
+    def print_image(image_path, format, settings, copies=None):
+        calls.append((image_path.name, copies))
+        return results.get(image_path.name, 0)
+
+    monkeypatch.setattr(print_queue, "print_image", print_image)
+    monkeypatch.setattr(PrintQueue, "retry_delay", 0)
+    calls.results = results
+    return calls
+
+
+@pytest.fixture
+def images(tmp_path):
+    directory = tmp_path / "images"
+    directory.mkdir()
+    for name in ("a.jpg", "b.jpg"):
+        (directory / name).write_bytes(b"image")
+    return directory
+
+
+def wait(condition, timeout: float = 5):
+    deadline = time.monotonic() + timeout
+    while not condition():
+        assert time.monotonic() < deadline, "timed out"
+        time.sleep(0.01)
+
+
+def settings(**update) -> PrintingConfig:
+    return PrintingConfig(enabled=True, **update)
+
+
+def test_keyed_jobs_are_printed_once(tmp_path, images, printed):
+    queue = PrintQueue(tmp_path / "queue", settings())
+    assert queue.submit(images / "a.jpg", key="session") == 1
+    assert queue.submit(images / "a.jpg", key="session") == 1
+    queue.start()
+    wait(lambda: queue.depth == 0)
+
+    # Restarted, the key is read back from printed.log
+    queue = PrintQueue(tmp_path / "queue", settings())
+    assert queue.submit(images / "a.jpg", key="session") == 0
+    queue.submit(images / "b.jpg", key="other")
+    queue.start()
+    wait(lambda: queue.depth == 0)
+
+    assert printed == [("a.jpg", 1), ("b.jpg", 1)]
+    assert (tmp_path / "queue" / "printed.log").read_text().splitlines() == ["session", "other"]
+
+
+def test_unkeyed_jobs_for_the_same_image_add_copies(tmp_path, images, printed):
+    queue = PrintQueue(tmp_path / "queue", settings())
+    queue.submit(images / "a.jpg")
+    queue.submit(images / "a.jpg", copies=2)
+    queue.start()
+    wait(lambda: queue.depth == 0)
+
+    assert printed == [("a.jpg", 3)]
+
+
+def test_jobs_are_reloaded_after_a_restart(tmp_path, images, printed):
+    queue = PrintQueue(tmp_path / "queue", settings())
+    queue.submit(images / "a.jpg", copies=2, key="session")
+    queue.submit(images / "b.jpg")
+    del queue
+
+    queue = PrintQueue(tmp_path / "queue", settings())
+    assert queue.depth == 2
+    assert queue.submit(images / "a.jpg", key="session") == 2
+    queue.start()
+    wait(lambda: queue.depth == 0)
+
+    assert printed == [("a.jpg", 2), ("b.jpg", 1)]
+    assert list((tmp_path / "queue").glob("*.json")) == []
+
+
+def test_failing_jobs_are_parked(tmp_path, images, printed):
+    printed.results["a.jpg"] = 1
+    queue = PrintQueue(tmp_path / "queue", settings(max_attempts=3))
+    queue.submit(images / "a.jpg")
+    queue.submit(images / "b.jpg")
+    queue.start()
+    wait(lambda: queue.depth == 0)
+
+    # The failing job does not hold up the other one
+    assert printed == [("a.jpg", 1), ("b.jpg", 1), ("a.jpg", 1), ("a.jpg", 1)]
+    parked = list((tmp_path / "queue" / "failed").glob("*.json"))
+    assert len(parked) == 1
+    with open(parked[0]) as fh:
+        assert json.load(fh) == dict(image_path=str(images / "a.jpg"), copies=1, attempts=3, key=None)
+    assert list((tmp_path / "queue").glob("*.json")) == []
+
+
+def test_jobs_for_missing_images_are_parked(tmp_path, images, printed):
+    queue = PrintQueue(tmp_path / "queue", settings())
+    queue.submit(images / "a.jpg")
+    (images / "a.jpg").unlink()
+    queue.start()
+    wait(lambda: queue.depth == 0)
+
+    assert printed == []
+    assert len(list((tmp_path / "queue" / "failed").glob("*.json"))) == 1
@@ -0,0 +1,136 @@
+import asyncio
+import json
+import socket
+
+import pytest
+
+from app.transfer import TransferServer, receive
+
+
+def free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+def start_server(tmp_path, token=None) -> TransferServer:
+    server = TransferServer(
+        directory=tmp_path / "processed",
+        ledger=tmp_path / "transferred.log",
+        host="127.0.0.1",
+        port=free_port(),
+        token=token,
+    )
+    server.start()
+    return server
+
+
+async def receive_files(server: TransferServer, directory, count: int, token=None, timeout: float = 10):
+    received = []
+    done = asyncio.Event()
+
+    def on_file(path):
+        received.append(path.name)
+        if len(received) >= count:
+            done.set()
+
+    task = asyncio.ensure_future(receive(
+        host="127.0.0.1",
+        port=server.port,
+        directory=directory,
+        on_file=on_file,
+        token=token,
+        retry_delay=0.05,
+    ))
+    try:
+        await asyncio.wait_for(done.wait(), timeout)
+    finally:
+        task.cancel()
+    return received
+
+
+def publish(server: TransferServer, name: str, data: bytes):
+    path = server.directory / name
+    path.write_bytes(data)
+    server.publish(path)
+    return path
+
+
+def test_transfer(tmp_path):
+    server = start_server(tmp_path)
+    publish(server, "a.jpg", b"first")
+    publish(server, "b.jpg", b"second")
+
+    received = asyncio.run(receive_files(server, tmp_path / "fetch", 2))
+
+    assert received == ["a.jpg", "b.jpg"]
+    assert (tmp_path / "fetch" / "a.jpg").read_bytes() == b"first"
+    assert (tmp_path / "fetch" / "b.jpg").read_bytes() == b"second"
+
+
+def test_lost_ack_is_sent_again(tmp_path):
+    server = start_server(tmp_path)
+    publish(server, "a.jpg", b"first")
+
+    async def receive_without_ack():
+        # Takes the file and goes away before acknowledging it
+        reader, writer = await asyncio.open_connection("127.0.0.1", server.port)
+        header = json.loads(await reader.readline())
+        data = await reader.readexactly(header["size"])
+        writer.close()
+        return header["name"], data
+
+    assert asyncio.run(receive_without_ack()) == ("a.jpg", b"first")
+    assert not server.ledger.is_file()
+
+    received = asyncio.run(receive_files(server, tmp_path / "fetch", 1))
+
+    assert received == ["a.jpg"]
+    assert (tmp_path / "fetch" / "a.jpg").read_bytes() == b"first"
+    assert server.ledger.read_text().splitlines() == ["a.jpg"]
+
+
+def test_sent_files_are_not_sent_again(tmp_path):
+    server = start_server(tmp_path)
+    publish(server, "a.jpg", b"first")
+    asyncio.run(receive_files(server, tmp_path / "fetch", 1))
+
+    # Restarted booth, only the file missing from the ledger is sent
+    (tmp_path / "processed" / "b.jpg").write_bytes(b"second")
+    server = start_server(tmp_path)
+    received = asyncio.run(receive_files(server, tmp_path / "fetch", 1))
+
+    assert received == ["b.jpg"]
+
+
+def test_token(tmp_path):
+    server = start_server(tmp_path, token="secret")
+    publish(server, "a.jpg", b"first")
+
+    with pytest.raises(asyncio.TimeoutError):
+        asyncio.run(receive_files(server, tmp_path / "fetch", 1, token="wrong", timeout=1))
+    with pytest.raises(asyncio.TimeoutError):
+        asyncio.run(receive_files(server, tmp_path / "fetch", 1, timeout=1))
+    assert not (tmp_path / "fetch" / "a.jpg").exists()
+
+    received = asyncio.run(receive_files(server, tmp_path / "fetch", 1, token="secret"))
+
+    assert received == ["a.jpg"]
+
+
+def test_published_files_are_sent_once(tmp_path):
+    (tmp_path / "processed").mkdir()
+    (tmp_path / "processed" / "a.jpg").write_bytes(b"first")
+    (tmp_path / "processed" / "b.jpg").write_bytes(b"second")
+    (tmp_path / "transferred.log").write_text("b.jpg\n")
+    server = start_server(tmp_path)
+
+    # A resumed session publishes its montage, already queued or already sent
+    server.publish(tmp_path / "processed" / "a.jpg")
+    server.publish(tmp_path / "processed" / "b.jpg")
+    publish(server, "c.jpg", b"third")
+
+    # A duplicate would come before c.jpg
+    received = asyncio.run(receive_files(server, tmp_path / "fetch", 2))
+
+    assert received == ["a.jpg", "c.jpg"]